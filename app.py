@@ -6,15 +6,20 @@ content from various social media platforms.
 Supports: YouTube, Instagram, Facebook, Twitter/X, TikTok, and more.
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, redirect, Response, stream_with_context
 import os
 import sys
 import tempfile
+import gzip
+import hmac
+import json
+import math
 import shutil
+import time
 from datetime import datetime
 import logging
 from urllib.parse import urlparse
-import threading
+import sqlite3
 import uuid
 
 # Import our custom downloaders
@@ -23,16 +28,36 @@ from downloaders.instagram_downloader import InstagramDownloader
 from downloaders.facebook_downloader import FacebookDownloader
 from downloaders.twitter_downloader import TwitterDownloader
 from downloaders.tiktok_downloader import TikTokDownloader
+from downloaders import format_policy
+from utils import archive, clips, integrity, jobs, metrics, prefetch, profiling, scheduler, subscriptions, tracing
+from utils import assets as static_assets
+from utils import storage as storages
+from utils import work_queue as work_queues
+from utils.jobs import download_progress
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+app.add_template_global(static_assets.asset_url, 'asset_url')
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:[%(job_id)s] %(message)s')
+for handler in logging.getLogger().handlers:
+    handler.addFilter(tracing.JobContextFilter())
 logger = logging.getLogger(__name__)
 
-# Global download progress tracking
-download_progress = {}
+# Jobs waiting for a download slot or not at a downloader yet
+metrics.QUEUE_DEPTH.set_function(
+    lambda: sum(1 for p in list(download_progress.values()) if p.get('status') == 'starting')
+)
+
+# Platforms whose downloaders can fetch just a time range of a video
+CLIP_PLATFORMS = ('youtube', 'facebook')
+
+# Token for the /api/admin endpoints, which are disabled without one
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# /api/info bodies at least this large are gzipped for clients that accept it
+INFO_GZIP_MIN_BYTES = int(os.environ.get('INFO_GZIP_MIN_BYTES', 1024))
 
 class SocialMediaDownloader:
     def __init__(self):
@@ -59,30 +84,166 @@ class SocialMediaDownloader:
         else:
             return 'unknown'
     
-    def download_content(self, url, format_type='best', download_id=None):
+    def download_content(self, url, format_type='best', download_id=None, clip=None):
         """Download content from any supported platform"""
         platform = self.detect_platform(url)
+        if clip and platform not in CLIP_PLATFORMS:
+            raise ValueError(f"Clips are not supported for {platform}")
+        started = time.perf_counter()
+        metrics.ACTIVE_JOBS.inc(platform=platform)
         
         try:
-            if platform == 'youtube':
-                return self.youtube_dl.download(url, format_type, download_id)
-            elif platform == 'instagram':
-                return self.instagram_dl.download(url, format_type, download_id)
-            elif platform == 'facebook':
-                return self.facebook_dl.download(url, format_type, download_id)
-            elif platform == 'twitter':
-                return self.twitter_dl.download(url, format_type, download_id)
-            elif platform == 'tiktok':
-                return self.tiktok_dl.download(url, format_type, download_id)
-            else:
-                raise ValueError(f"Unsupported platform: {platform}")
+            with tracing.span('download', job_id=download_id, platform=platform):
+                if platform == 'youtube':
+                    result = self.youtube_dl.download(url, format_type, download_id, clip=clip)
+                elif platform == 'instagram':
+                    result = self.instagram_dl.download(url, format_type, download_id)
+                elif platform == 'facebook':
+                    result = self.facebook_dl.download(url, format_type, download_id, clip=clip)
+                elif platform == 'twitter':
+                    result = self.twitter_dl.download(url, format_type, download_id)
+                elif platform == 'tiktok':
+                    result = self.tiktok_dl.download(url, format_type, download_id)
+                else:
+                    raise ValueError(f"Unsupported platform: {platform}")
         except Exception as e:
+            if jobs.is_cancelled(download_id):
+                metrics.JOBS_TOTAL.inc(platform=platform, status='cancelled')
+                metrics.JOB_DURATION.observe(time.perf_counter() - started, platform=platform, status='cancelled')
+                logger.info(f"Download cancelled for {url}")
+                raise jobs.JobCancelled(str(e)) from e
+            metrics.ERRORS_TOTAL.inc(platform=platform, exception=metrics.exception_name(e))
+            metrics.JOBS_TOTAL.inc(platform=platform, status='error')
+            metrics.JOB_DURATION.observe(time.perf_counter() - started, platform=platform, status='error')
             logger.error(f"Download failed for {url}: {str(e)}")
             raise
+        finally:
+            metrics.ACTIVE_JOBS.dec(platform=platform)
+        
+        metrics.JOBS_TOTAL.inc(platform=platform, status='completed')
+        metrics.JOB_DURATION.observe(time.perf_counter() - started, platform=platform, status='completed')
+        return result
 
 # Initialize downloader
 downloader = SocialMediaDownloader()
 
+# Durable queue shared with worker.py, None to download in this process
+work_queue = work_queues.from_env()
+if work_queue is not None:
+    metrics.QUEUE_DEPTH.set_function(work_queue.depth)
+
+# Where finished files are kept and served from
+storage = storages.from_env()
+
+# Staging directories of jobs that died with an earlier process
+integrity.clean_staging()
+
+# Fair sharing of the download slots between clients, and their daily usage
+job_scheduler = scheduler.FairScheduler.from_env()
+usage = scheduler.usage_from_env(work_queue)
+
+def run_download(download_id, url, format_type, queued_ns=None, clip=None):
+    """Run a registered job and record its outcome in download_progress"""
+    if queued_ns:
+        tracing.record('queued', queued_ns, time.time_ns(), job_id=download_id)
+    with tracing.span('job', job_id=download_id, url=url, format=format_type, clip=bool(clip)):
+        try:
+            jobs.check_cancelled(download_id)
+            # Checked again here: a client under quota may queue any number of jobs
+            client = download_progress[download_id].get('client')
+            if client and client != subscriptions.CLIENT and usage.over_quota(client):
+                raise Exception('Daily download quota exceeded')
+            result = downloader.download_content(url, format_type, download_id, clip)
+            jobs.check_cancelled(download_id)
+            # Verified files move out of the job's staging directory
+            with tracing.span('commit', job_id=download_id):
+                integrity.commit_result(download_id, result)
+            # A cancel that arrived after the last check still wins
+            for item in result.get('items') or [{'path': result.get('file_path')}]:
+                jobs.track_file(download_id, item.get('path'))
+            jobs.check_cancelled(download_id)
+            with tracing.span('store', job_id=download_id):
+                storages.commit_result(storage, download_id, result)
+            download_progress[download_id].update({
+                'status': 'completed',
+                'progress': 100,
+                'result': result
+            })
+            if download_progress[download_id].get('client'):
+                usage.record(download_progress[download_id]['client'], scheduler.result_size(result))
+        except jobs.JobCancelled:
+            removed = jobs.remove_files(download_id)
+            download_progress[download_id].update({
+                'status': 'cancelled',
+                'error': 'Download cancelled'
+            })
+            logger.info(f"Download {download_id} cancelled, removed {removed} partial file(s)")
+        except Exception as e:
+            download_progress[download_id].update({
+                'status': 'error',
+                'error': str(e)
+            })
+        finally:
+            integrity.discard(download_id)
+            jobs.finish(download_id)
+
+def submit_download(url, format_type='best', clip=None, client=subscriptions.CLIENT):
+    """Start a download job, or queue it for worker.py; returns its id"""
+    # With a work queue the download runs on a worker
+    if work_queue is not None:
+        return work_queues.enqueue_download(work_queue, url, format_type, clip, client)
+    
+    # Generate unique download ID
+    download_id = str(uuid.uuid4())
+    start_download(download_id, url, format_type, clip, client=client)
+    return download_id
+
+def start_download(download_id, url, format_type='best', clip=None, speculative=False, client=None):
+    """Register a job and schedule it among the client's other jobs"""
+    download_progress[download_id] = {
+        'status': 'starting',
+        'progress': 0,
+        'url': url,
+        'format': format_type,
+        'clip': clip,
+        'client': client
+    }
+    if speculative:
+        download_progress[download_id]['speculative'] = True
+    # Nobody polls a speculative job until a client claims it, nor a subscription's
+    jobs.register(download_id, reap=not speculative and client != subscriptions.CLIENT)
+    
+    # Runs in a background thread once a download slot is free; speculative
+    # jobs share the low-priority 'prefetch' queue until they are claimed
+    queued_ns = time.time_ns()
+    job_scheduler.submit('prefetch' if speculative or not client else client, download_id,
+                         lambda: run_download(download_id, url, format_type, queued_ns, clip))
+
+def delete_files(result):
+    """Remove every stored file of a finished download"""
+    for key, _ in storages.result_files(result):
+        storage.delete(key)
+
+def discard_download(download_id):
+    """Forget a finished job and delete its files"""
+    progress = download_progress.pop(download_id, None) or {}
+    if progress.get('result'):
+        delete_files(progress['result'])
+
+# Speculative downloads started by /api/info, in-process mode only
+prefetcher = prefetch.Prefetcher.from_env(start_download, discard_download) if work_queue is None else None
+
+def _job_state(download_id):
+    """Progress snapshot of a job, wherever it runs"""
+    if work_queue is not None:
+        return work_queue.get(download_id)
+    return download_progress.get(download_id)
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    """Fingerprinted static files, cacheable for good"""
+    return static_assets.serve(filename)
+
 @app.route('/')
 def index():
     """Main page with download interface"""
@@ -99,37 +260,33 @@ def api_download():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        # Generate unique download ID
-        download_id = str(uuid.uuid4())
-        download_progress[download_id] = {
-            'status': 'starting',
-            'progress': 0,
-            'url': url,
-            'format': format_type
-        }
-        
-        # Start download in background thread
-        def download_task():
-            try:
-                result = downloader.download_content(url, format_type, download_id)
-                download_progress[download_id].update({
-                    'status': 'completed',
-                    'progress': 100,
-                    'result': result
-                })
-            except Exception as e:
-                download_progress[download_id].update({
-                    'status': 'error',
-                    'error': str(e)
-                })
-        
-        thread = threading.Thread(target=download_task)
-        thread.daemon = True
-        thread.start()
+        # Optional clip: start/end in seconds or [HH:]MM:SS
+        try:
+            clip = clips.parse_clip(data.get('start'), data.get('end'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if clip and downloader.detect_platform(url) not in CLIP_PLATFORMS:
+            return jsonify({'error': 'Clips are supported for YouTube and Facebook videos'}), 400
+        
+        client = scheduler.client_id(request)
+        if usage.over_quota(client):
+            return jsonify({'error': 'Daily download quota exceeded'}), 429
+        
+        # A download prefetched after /api/info is handed over as is
+        download_id = prefetcher.claim(url, format_type, clip) if prefetcher else None
+        if download_id:
+            billed = download_progress[download_id].get('client')
+            download_progress[download_id]['client'] = client
+            # Still waiting for a slot: queue it under the client's share
+            job_scheduler.retag(download_id, client)
+            # Finished prefetches were billed to whoever triggered them
+            if download_progress[download_id]['status'] == 'completed' and billed != client:
+                usage.record(client, scheduler.result_size(download_progress[download_id]['result']))
+        download_id = download_id or submit_download(url, format_type, clip, client)
         
         return jsonify({
             'download_id': download_id,
-            'status': 'started'
+            'status': 'queued' if work_queue is not None else 'started'
         })
         
     except Exception as e:
@@ -139,26 +296,156 @@ def api_download():
 @app.route('/api/progress/<download_id>')
 def api_progress(download_id):
     """Get download progress"""
-    if download_id in download_progress:
-        return jsonify(download_progress[download_id])
+    progress = _job_state(download_id)
+    if progress is not None:
+        if work_queue is not None:
+            work_queue.touch(download_id)
+        else:
+            jobs.touch(download_id)
+        return jsonify(progress)
     else:
         return jsonify({'error': 'Download not found'}), 404
 
+@app.route('/api/download/<download_id>', methods=['DELETE'])
+def api_cancel_download(download_id):
+    """Cancel a running download, or delete the files of a finished one"""
+    progress = _job_state(download_id)
+    if progress is None:
+        return jsonify({'error': 'Download not found'}), 404
+    
+    if work_queue is not None:
+        if work_queue.request_cancel(download_id):
+            return jsonify({'download_id': download_id, 'status': 'cancelling'}), 202
+        work_queue.delete(download_id)
+    elif jobs.cancel(download_id):
+        return jsonify({'download_id': download_id, 'status': 'cancelling'}), 202
+    else:
+        download_progress.pop(download_id, None)
+    
+    if progress.get('result'):
+        delete_files(progress['result'])
+    return jsonify({'download_id': download_id, 'status': 'deleted'})
+
 @app.route('/api/download_file/<download_id>')
 def api_download_file(download_id):
     """Download the actual file"""
-    if download_id not in download_progress:
+    progress = _job_state(download_id)
+    if progress is None:
         return jsonify({'error': 'Download not found'}), 404
     
-    progress = download_progress[download_id]
     if progress['status'] != 'completed':
         return jsonify({'error': 'Download not completed'}), 400
     
-    file_path = progress['result']['file_path']
-    if not os.path.exists(file_path):
-        return jsonify({'error': 'File not found'}), 404
+    result = progress['result']
     
-    return send_file(file_path, as_attachment=True)
+    # ?archive=zip bundles every item of a multi-image/carousel post
+    if request.args.get('archive') == 'zip':
+        files = [(storage.fetch(key), filename) for key, filename in storages.result_files(result)]
+        if not all(path for path, _ in files):
+            return jsonify({'error': 'File not found'}), 404
+        
+        def generate():
+            with tracing.span('serve', job_id=download_id, archive='zip', items=len(files)):
+                yield from archive.stream_zip(files)
+        
+        response = Response(stream_with_context(generate()), mimetype='application/zip')
+        response.headers['Content-Disposition'] = storages.content_disposition(archive.archive_name(files))
+        return response
+    
+    key = result.get('storage_key') or result['file_path']
+    filename = result.get('filename') or os.path.basename(result['file_path'])
+    with tracing.span('serve', job_id=download_id):
+        # Object storage hands the bytes out itself
+        url = storage.url(key, filename) if storages.REDIRECT else None
+        if url:
+            return redirect(url)
+        
+        file_path = storage.fetch(key)
+        if not file_path:
+            return jsonify({'error': 'File not found'}), 404
+        
+        return send_file(os.path.abspath(file_path), as_attachment=True, download_name=filename)
+
+@app.route('/api/usage')
+def api_usage():
+    """Today's usage, quota and scheduling state of the calling client"""
+    client = scheduler.client_id(request)
+    today = usage.get(client)
+    quota = usage.daily_quota
+    return jsonify({
+        'client': client if client == request.remote_addr else f"key:{client[:4]}...",
+        'today': today,
+        'quota_bytes': quota,
+        'remaining_bytes': max(0, quota - today['bytes']) if quota else None,
+        **job_scheduler.client_state(client)
+    })
+
+@app.route('/api/jobs/<download_id>/trace')
+def api_job_trace(download_id):
+    """Stage-by-stage span timeline of a download job"""
+    trace = tracing.get_trace(download_id)
+    if work_queue is not None:
+        # Queued jobs are traced by their worker; only serving happens here
+        shared = work_queue.get_trace(download_id)
+        if shared is not None:
+            trace = tracing.merge(shared, trace)
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    return jsonify(trace)
+
+@app.route('/api/subscriptions', methods=['GET', 'POST'])
+def api_subscriptions():
+    """List watched sources, or register a channel/account to watch"""
+    store = subscriptions.get_store()
+    if request.method == 'GET':
+        return jsonify({'subscriptions': store.list()})
+    
+    data = request.get_json() or {}
+    url = data.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    
+    platform = downloader.detect_platform(url)
+    if platform == 'unknown':
+        return jsonify({'error': 'Unsupported platform'}), 400
+    
+    try:
+        source = store.add(url, platform, data.get('format', 'best'),
+                           float(data.get('interval', subscriptions.DEFAULT_INTERVAL)),
+                           bool(data.get('backfill', False)))
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'Already subscribed'}), 409
+    return jsonify(source), 201
+
+@app.route('/api/subscriptions/<int:source_id>', methods=['DELETE'])
+def api_unsubscribe(source_id):
+    """Stop watching a source and drop its seen-item archive"""
+    if not subscriptions.get_store().remove(source_id):
+        return jsonify({'error': 'Subscription not found'}), 404
+    return jsonify({'id': source_id, 'status': 'deleted'})
+
+def compact_info(info, fields=None, formats='full'):
+    """Project info onto the requested fields and summarize its formats"""
+    if fields:
+        info = {key: info[key] for key in fields if key in info}
+    else:
+        info = dict(info)
+    if 'formats' in info:
+        if formats == 'ladder':
+            info['formats'] = format_policy.ladder(info['formats'])
+        elif formats == 'none':
+            del info['formats']
+    return info
+
+def json_response(payload):
+    """Compact JSON, gzipped when large and the client accepts it"""
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    if len(body) >= INFO_GZIP_MIN_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 @app.route('/api/info', methods=['POST'])
 def api_info():
@@ -185,15 +472,70 @@ def api_info():
         else:
             return jsonify({'error': f'Unsupported platform: {platform}'}), 400
         
-        return jsonify({
+        # Start on the format the client has selected while the user decides,
+        # unless the client has used up its quota
+        client = scheduler.client_id(request)
+        if prefetcher and not usage.over_quota(client):
+            prefetcher.speculate(url, data.get('format') or 'best', info, client)
+        
+        # ?fields=title,duration,formats&formats=ladder (or the same keys in the body)
+        fields = request.args.get('fields') or data.get('fields')
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+        formats = request.args.get('formats') or data.get('formats') or 'full'
+        if formats not in ('full', 'ladder', 'none'):
+            return jsonify({'error': 'formats must be full, ladder or none'}), 400
+        
+        return json_response({
             'platform': platform,
-            'info': info
+            'info': compact_info(info, fields, formats)
         })
         
     except Exception as e:
         logger.error(f"Info API error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def is_admin():
+    """Whether the request carries the admin token"""
+    token = request.headers.get('X-Admin-Token', '')
+    if not token and request.headers.get('Authorization', '').startswith('Bearer '):
+        token = request.headers['Authorization'][len('Bearer '):]
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/api/admin/profile', methods=['POST'])
+def api_admin_profile():
+    """Sample where this worker process spends its time (admin only)"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', profiling.DEFAULT_INTERVAL))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    # float() also accepts nan and inf, which the clamps in profiling let through
+    if not all(math.isfinite(value) and value > 0 for value in (seconds, interval)):
+        return jsonify({'error': 'seconds and interval must be positive, finite numbers'}), 400
+    memory = request.args.get('memory', 'false').lower() in ('1', 'true')
+    
+    try:
+        report = profiling.profile(seconds, max(interval, 0.001), memory=memory)
+    except profiling.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    
+    # ?format=folded is fed straight to flamegraph.pl / speedscope
+    if request.args.get('format') == 'folded':
+        return Response(report['folded'] + '\n', mimetype='text/plain')
+    report['pid'] = os.getpid()
+    return jsonify(report)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint (metrics are per worker process)"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
@@ -210,4 +552,9 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
+    # Poll subscriptions from this process (with several processes use worker.py --watch)
+    if os.environ.get('WATCH_SUBSCRIPTIONS', 'False').lower() == 'true':
+        subscriptions.SubscriptionScheduler(subscriptions.get_store(), submit_download,
+                                            job_state=_job_state).start()
+    
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: streaming media extraction vs whole-page regex scans
+Runs the regexes the Twitter/Facebook fallbacks used to apply to the full
+response text and downloaders/html_media.py on the same pages, and reports
+time per page and which URL each approach would download.
+
+Pages come from --pages (a directory of captured .html files) and/or the
+synthetic platform pages served by the fake origin.
+
+Example:
+    python benchmarks/bench_html_extract.py --padding-kb 4096 --repeat 20
+    python benchmarks/bench_html_extract.py --pages ~/captured_pages --no-synthetic
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_origin import image_post_page, instagram_page, video_page  # noqa: E402
+from downloaders.html_media import extract_from_html  # noqa: E402
+
+# The patterns previously used by the image fallbacks (made scheme-agnostic so
+# they also match the synthetic pages)
+LEGACY_PATTERNS = {
+    'facebook': re.compile(r'https?://[^"]*\.(?:jpg|jpeg|png|gif)'),
+    'twitter': re.compile(r'https?://[^"]*/media/[^"]*\.(?:jpg|jpeg|png|gif)'),
+}
+
+
+def synthetic_pages(padding_kb):
+    return {
+        'facebook_photo': ('facebook', image_post_page('bench.facebook.com', '1001', 4, padding_kb)),
+        'twitter_status': ('twitter', image_post_page('bench.twitter.com', '2002', 4, padding_kb)),
+        'instagram_post': ('facebook', instagram_page('bench.instagram.com', 'Cbench', 6, padding_kb)),
+        'video_page': ('facebook', video_page('bench.facebook.com', 'v3003', 1000, padding_kb)),
+    }
+
+
+def captured_pages(directory):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.htm*'))):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            name = os.path.basename(path)
+            pages[name] = ('twitter' if 'twitter' in name or 'x.com' in name else 'facebook', f.read())
+    return pages
+
+
+def best_time(function, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare regex scans with streaming extraction')
+    parser.add_argument('--pages', help='directory of captured .html pages')
+    parser.add_argument('--no-synthetic', action='store_true')
+    parser.add_argument('--padding-kb', type=int, default=2048, help='markup added to synthetic pages')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    pages = {} if args.no_synthetic else synthetic_pages(args.padding_kb)
+    if args.pages:
+        pages.update(captured_pages(args.pages))
+    if not pages:
+        parser.error('no pages to benchmark')
+
+    print(f"{'page':<24}{'size':>10}{'regex ms':>11}{'stream ms':>11}{'speedup':>9}")
+    for name, (legacy, text) in pages.items():
+        pattern = LEGACY_PATTERNS[legacy]
+        regex_time, regex_urls = best_time(lambda: pattern.findall(text), args.repeat)
+        stream_time, candidates = best_time(lambda: extract_from_html(text), args.repeat)
+        speedup = regex_time / stream_time if stream_time else float('inf')
+        print(f"{name:<24}{len(text) // 1024:>8}KB{regex_time * 1000:>11.2f}"
+              f"{stream_time * 1000:>11.2f}{speedup:>8.1f}x")
+        print(f"    regex picks:  {regex_urls[0] if regex_urls else '-'}")
+        print(f"    stream picks: {candidates[0].url if candidates else '-'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Local stand-in for the media origins used by the benchmark suite
+Serves synthetic media files, HLS playlists and YouTube/TikTok/Instagram/
+Twitter/Facebook-shaped HTML pages. It also acts as a plain HTTP forward proxy,
+so pointing http_proxy at it sends every platform request here instead of the
+network.
+"""
+
+import html
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+DEFAULT_MEDIA_SIZE = 2 * 1024 * 1024
+HLS_SEGMENTS = 6
+CHUNK_SIZE = 64 * 1024
+
+# Hosts that detect_platform() recognises but no dedicated yt-dlp extractor
+# claims, so the generic extractor downloads straight from the fake origin
+BENCH_HOSTS = {
+    'youtube': 'media.youtube.com.bench',
+    'tiktok': 'bench.tiktok.com',
+    'twitter': 'bench.twitter.com',
+    'facebook': 'bench.facebook.com',
+    'instagram': 'bench.instagram.com',
+}
+
+
+def synthetic_bytes(size, seed=0):
+    """Deterministic filler content of the requested size"""
+    block = bytes((seed + i) % 251 for i in range(CHUNK_SIZE))
+    full, rest = divmod(size, CHUNK_SIZE)
+    return block * full + block[:rest]
+
+
+def _padding(kb):
+    """Markup noise that makes pages as heavy as real ones"""
+    if not kb:
+        return ''
+    row = ('<div class="x1n2onr6"><img src="https://static.example/rsrc/pixel.gif" '
+           'width="1" height="1"><a href="/profile/friend">friend</a></div>\n')
+    return row * max(1, kb * 1024 // len(row))
+
+
+def _media_url(host, name, size):
+    return f'http://{host}/media/{name}.mp4?size={size}'
+
+
+def _image_url(host, name, width, height):
+    return f'http://{host}/media/{name}_{width}x{height}.jpg?size={width * height // 8}'
+
+
+def video_page(host, page_id, size, pad_kb=0, title=None):
+    """Watch page with og:video and an HTML5 <video> element"""
+    title = html.escape(title or f'bench video {page_id}')
+    media = _media_url(host, page_id, size)
+    return f"""<!DOCTYPE html>
+<html><head>
+<title>{title}</title>
+<meta property="og:title" content="{title}">
+<meta property="og:type" content="video.other">
+<meta property="og:video" content="{media}">
+<meta property="og:video:type" content="video/mp4">
+<meta property="og:image" content="{_image_url(host, page_id + '_thumb', 640, 360)}">
+</head><body>
+{_padding(pad_kb)}
+<video controls src="{media}" type="video/mp4"></video>
+</body></html>"""
+
+
+def image_post_page(host, post_id, images=4, pad_kb=0):
+    """Twitter/Facebook-shaped image post: avatars and pixels first, media last"""
+    avatar = _image_url(host, f'{post_id}_avatar', 48, 48)
+    media = [_image_url(host, f'{post_id}_{i}', 1200, 900) for i in range(images)]
+    small = [_image_url(host, f'{post_id}_{i}_small', 240, 180) for i in range(images)]
+    ld_json = json.dumps({
+        '@context': 'https://schema.org',
+        '@type': 'SocialMediaPosting',
+        'image': [{'@type': 'ImageObject', 'url': u, 'width': 1200, 'height': 900} for u in media],
+    })
+    imgs = '\n'.join(f'<img src="{s}" width="240" height="180">' for s in small)
+    return f"""<!DOCTYPE html>
+<html><head>
+<title>bench post {post_id}</title>
+<link rel="icon" href="{_image_url(host, 'favicon', 32, 32)}">
+<link rel="preload" as="image" href="{avatar}">
+<meta property="og:title" content="bench post {post_id}">
+<meta property="og:image" content="{media[0]}">
+<meta property="og:image:width" content="1200">
+<meta property="og:image:height" content="900">
+<meta name="twitter:image" content="{small[0]}">
+<script type="application/ld+json">{ld_json}</script>
+</head><body>
+<img src="{avatar}" width="48" height="48">
+{_padding(pad_kb)}
+{imgs}
+</body></html>"""
+
+
+def instagram_page(host, shortcode, items=3, pad_kb=0):
+    """Instagram-shaped post page with a sidecar in embedded JSON"""
+    edges = []
+    for i in range(items):
+        node = {
+            'display_url': _image_url(host, f'{shortcode}_{i}', 1080, 1350),
+            'dimensions': {'width': 1080, 'height': 1350},
+            'is_video': i == items - 1,
+        }
+        if node['is_video']:
+            node['video_url'] = _media_url(host, f'{shortcode}_{i}', DEFAULT_MEDIA_SIZE // 4)
+        edges.append({'node': node})
+    shared = {'entry_data': {'PostPage': [{'graphql': {'shortcode_media': {
+        'shortcode': shortcode,
+        'display_url': edges[0]['node']['display_url'],
+        'edge_sidecar_to_children': {'edges': edges},
+    }}}]}}
+    return f"""<!DOCTYPE html>
+<html><head>
+<title>Instagram post {shortcode}</title>
+<meta property="og:image" content="{edges[0]['node']['display_url']}">
+<meta property="og:type" content="instapp:photo">
+</head><body>
+{_padding(pad_kb)}
+<script type="text/javascript">window._sharedData = {json.dumps(shared)};</script>
+</body></html>"""
+
+
+def hls_master(host, name):
+    return f"""#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+http://{host}/hls/{name}/360p.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2400000,RESOLUTION=1280x720
+http://{host}/hls/{name}/720p.m3u8
+"""
+
+
+def hls_media(host, name, variant, segments=HLS_SEGMENTS):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(segments):
+        lines.append('#EXTINF:4.0,')
+        lines.append(f'http://{host}/hls/{name}/{variant}_{i}.ts')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+class FakeOriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        server = self.server
+        parts = urlsplit(self.path)
+        host = parts.netloc or self.headers.get('Host', 'localhost')
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        path = parts.path
+        server.count_request()
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        pad_kb = int(query.get('pad_kb', server.page_padding_kb))
+        size = int(query.get('size', server.media_size))
+
+        m = re.match(r'^/media/([\w.-]+?)\.(mp4|jpg|jpeg|png|gif)$', path)
+        if m:
+            ctype = 'video/mp4' if m.group(2) == 'mp4' else f'image/{m.group(2).replace("jpg", "jpeg")}'
+            return self._send_media(synthetic_bytes(size, seed=len(m.group(1))), ctype, send_body)
+
+        m = re.match(r'^/hls/([\w-]+)/(master|360p|720p)(?:_(\d+))?\.(m3u8|ts)$', path)
+        if m:
+            name, variant, index, ext = m.groups()
+            if ext == 'ts':
+                return self._send_media(synthetic_bytes(size // HLS_SEGMENTS, seed=int(index or 0)),
+                                        'video/mp2t', send_body)
+            body = hls_master(host, name) if variant == 'master' else hls_media(host, name, variant)
+            return self._send_text(body, 'application/vnd.apple.mpegurl', send_body)
+
+        m = re.match(r'^/p/([\w-]+)/?$', path)
+        if m:
+            items = int(query.get('items', 3))
+            return self._send_text(instagram_page(host, m.group(1), items, pad_kb), 'text/html', send_body)
+
+        m = re.match(r'^/[\w.-]+/status/(\d+)$', path) or re.match(r'^/photo/(\d+)$', path)
+        if m and query.get('kind', 'image') == 'image':
+            images = int(query.get('images', 4))
+            return self._send_text(image_post_page(host, m.group(1), images, pad_kb), 'text/html', send_body)
+
+        m = (re.match(r'^/watch/([\w-]+)$', path) or re.match(r'^/@[\w.-]+/video/(\d+)$', path)
+             or re.match(r'^/[\w.-]+/status/(\d+)$', path) or re.match(r'^/photo/(\d+)$', path))
+        if m:
+            return self._send_text(video_page(host, m.group(1), size, pad_kb), 'text/html', send_body)
+
+        self._send_text('not found', 'text/plain', send_body, status=404)
+
+    def _send_text(self, body, ctype, send_body, status=200):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{ctype}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if send_body:
+            self._write(data)
+
+    def _send_media(self, data, ctype, send_body):
+        start, end = 0, len(data) - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        m = re.match(r'bytes=(\d*)-(\d*)', range_header or '')
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), end) if m.group(2) else end
+            else:
+                start = max(0, len(data) - int(m.group(2)))
+            status = 206
+        body = data[start:end + 1]
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        if send_body:
+            self._write(body)
+
+    def _write(self, data):
+        bandwidth = self.server.bandwidth
+        for offset in range(0, len(data), CHUNK_SIZE):
+            chunk = data[offset:offset + CHUNK_SIZE]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+            self.server.count_bytes(len(chunk))
+
+
+class FakeOrigin(ThreadingHTTPServer):
+    """Threaded fake origin; use as a context manager or call start()/stop()"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=None,
+                 media_size=DEFAULT_MEDIA_SIZE, page_padding_kb=0):
+        super().__init__((host, port), FakeOriginHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.media_size = media_size
+        self.page_padding_kb = page_padding_kb
+        self.requests_served = 0
+        self.bytes_served = 0
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def proxy_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count_request(self):
+        with self._stats_lock:
+            self.requests_served += 1
+
+    def count_bytes(self, num_bytes):
+        with self._stats_lock:
+            self.bytes_served += num_bytes
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the fake media origin on its own')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes/sec per connection')
+    args = parser.parse_args()
+
+    origin = FakeOrigin(port=args.port, latency=args.latency, bandwidth=args.bandwidth)
+    print(f'Fake origin listening on {origin.proxy_url} (use it as http_proxy)')
+    try:
+        origin.serve_forever()
+    except KeyboardInterrupt:
+        origin.server_close()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark for the download engine and the Flask API
+Starts the fake origin, routes every platform request to it through
+http_proxy, and drives SocialMediaDownloader (or /api/download) at a fixed
+concurrency. Reports jobs/sec, p50/p99 latency, peak RSS and peak open file
+descriptors, and exits non-zero when a threshold or baseline regression is hit.
+
+Example:
+    python benchmarks/run_benchmark.py --jobs 40 --concurrency 8 --mode both
+    python benchmarks/run_benchmark.py --output bench.json
+    python benchmarks/run_benchmark.py --baseline bench.json --max-regression 0.15
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_origin import FakeOrigin, BENCH_HOSTS  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Instagram is not included: instaloader talks to the Instagram API over
+# HTTPS, which a plain HTTP stand-in cannot intercept.
+SCENARIOS = {
+    'youtube': ('http://{youtube}/watch/yt{n}', 'best'),
+    'youtube_hls': ('http://{youtube}/hls/yt{n}/master.m3u8', 'best'),
+    'tiktok': ('http://{tiktok}/@bench/video/{n}', 'best'),
+    'twitter': ('http://{twitter}/bench/status/{n}?kind=video', 'best'),
+    'facebook': ('http://{facebook}/watch/fb{n}', 'best'),
+    'twitter_image': ('http://{twitter}/bench/status/{n}', 'image'),
+    'facebook_image': ('http://{facebook}/photo/{n}', 'image'),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def open_fd_count():
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class FdSampler(threading.Thread):
+    """Track the peak number of open file descriptors while jobs run"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = open_fd_count()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            count = open_fd_count()
+            if count is not None and (self.peak is None or count > self.peak):
+                self.peak = count
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def build_jobs(scenarios, count, first=0):
+    jobs = []
+    for n in range(first, first + count):
+        name = scenarios[n % len(scenarios)]
+        template, format_type = SCENARIOS[name]
+        jobs.append((name, template.format(n=n, **BENCH_HOSTS), format_type))
+    return jobs
+
+
+def run_engine_job(engine, url, format_type):
+    engine.download_content(url, format_type)
+
+
+def run_api_job(client, url, format_type, poll_interval, timeout):
+    response = client.post('/api/download', json={'url': url, 'format': format_type})
+    if response.status_code != 200:
+        raise RuntimeError(f'/api/download returned {response.status_code}')
+    download_id = response.get_json()['download_id']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        progress = client.get(f'/api/progress/{download_id}').get_json()
+        if progress['status'] == 'completed':
+            return
+        if progress['status'] == 'error':
+            raise RuntimeError(progress.get('error', 'download failed'))
+        time.sleep(poll_interval)
+    raise TimeoutError(f'job {download_id} did not finish in {timeout}s')
+
+
+def run_mode(mode, jobs, warmup_jobs, concurrency, args):
+    import app as web_app
+
+    if mode == 'engine':
+        engine = web_app.SocialMediaDownloader()
+
+        def run(job):
+            run_engine_job(engine, job[1], job[2])
+    else:
+        client = web_app.app.test_client()
+
+        def run(job):
+            run_api_job(client, job[1], job[2], args.poll_interval, args.job_timeout)
+
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def timed(job):
+        started = time.perf_counter()
+        try:
+            run(job)
+        except Exception as e:
+            with lock:
+                failures.append({'scenario': job[0], 'url': job[1], 'error': str(e)})
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    for job in warmup_jobs:
+        timed(job)
+    latencies.clear()
+    failures.clear()
+
+    sampler = FdSampler()
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, jobs))
+    wall = time.perf_counter() - started
+    sampler.stop()
+
+    return {
+        'mode': mode,
+        'jobs': len(jobs),
+        'concurrency': concurrency,
+        'completed': len(latencies),
+        'failed': len(failures),
+        'wall_seconds': round(wall, 3),
+        'jobs_per_sec': round(len(latencies) / wall, 3) if wall else 0.0,
+        'p50_seconds': round(percentile(latencies, 50), 4) if latencies else None,
+        'p99_seconds': round(percentile(latencies, 99), 4) if latencies else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource else None,
+        'peak_open_fds': sampler.peak,
+        'failures': failures[:10],
+    }
+
+
+def check_thresholds(results, args, baseline):
+    problems = []
+    for result in results:
+        mode = result['mode']
+        if result['failed'] > args.max_failures:
+            problems.append(f"{mode}: {result['failed']} failed jobs (max {args.max_failures})")
+        if args.min_jobs_per_sec and result['jobs_per_sec'] < args.min_jobs_per_sec:
+            problems.append(f"{mode}: {result['jobs_per_sec']} jobs/sec < {args.min_jobs_per_sec}")
+        if args.max_p99 and result['p99_seconds'] is not None and result['p99_seconds'] > args.max_p99:
+            problems.append(f"{mode}: p99 {result['p99_seconds']}s > {args.max_p99}s")
+
+        previous = next((b for b in baseline if b['mode'] == mode), None)
+        if not previous:
+            continue
+        allowed = args.max_regression
+        if previous['jobs_per_sec'] and result['jobs_per_sec'] < previous['jobs_per_sec'] * (1 - allowed):
+            problems.append(f"{mode}: jobs/sec regressed {previous['jobs_per_sec']} -> {result['jobs_per_sec']}")
+        if previous.get('p99_seconds') and result['p99_seconds'] is not None \
+                and result['p99_seconds'] > previous['p99_seconds'] * (1 + allowed):
+            problems.append(f"{mode}: p99 regressed {previous['p99_seconds']}s -> {result['p99_seconds']}s")
+    return problems
+
+
+def print_result(result):
+    print(f"[{result['mode']}] {result['completed']}/{result['jobs']} jobs "
+          f"@ concurrency {result['concurrency']} in {result['wall_seconds']}s: "
+          f"{result['jobs_per_sec']} jobs/sec, p50 {result['p50_seconds']}s, "
+          f"p99 {result['p99_seconds']}s, peak RSS {result['peak_rss_mb']} MB, "
+          f"peak fds {result['peak_open_fds']}")
+    for failure in result['failures']:
+        print(f"    failed {failure['scenario']}: {failure['error']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--mode', choices=['engine', 'api', 'both'], default='engine')
+    parser.add_argument('--jobs', type=int, default=20, help='jobs per mode')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=2, help='untimed jobs run first')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'comma separated subset of: {", ".join(SCENARIOS)}')
+    parser.add_argument('--media-size', type=int, default=2 * 1024 * 1024, help='bytes per media file')
+    parser.add_argument('--page-padding-kb', type=int, default=0, help='extra markup per HTML page')
+    parser.add_argument('--origin-latency', type=float, default=0.0, help='seconds per origin response')
+    parser.add_argument('--origin-bandwidth', type=float, default=None, help='bytes/sec per connection')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='API mode progress polling')
+    parser.add_argument('--job-timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON results from a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.15,
+                        help='allowed fractional drop in jobs/sec or rise in p99 vs baseline')
+    parser.add_argument('--min-jobs-per-sec', type=float, default=None)
+    parser.add_argument('--max-p99', type=float, default=None, help='seconds')
+    parser.add_argument('--max-failures', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='show downloader output')
+    parser.add_argument('--keep-files', action='store_true', help='keep the temporary downloads dir')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        print(f'Unknown scenarios: {", ".join(unknown)}', file=sys.stderr)
+        return 2
+
+    logging.basicConfig(level=logging.CRITICAL)
+    workdir = tempfile.mkdtemp(prefix='smd-bench-')
+    origin = FakeOrigin(latency=args.origin_latency, bandwidth=args.origin_bandwidth,
+                        media_size=args.media_size, page_padding_kb=args.page_padding_kb)
+    previous_cwd = os.getcwd()
+    with origin:
+        for name in ('http_proxy', 'HTTP_PROXY'):
+            os.environ[name] = origin.proxy_url
+        for name in ('no_proxy', 'NO_PROXY'):
+            os.environ.pop(name, None)
+        # Downloaders write to ./downloads, keep that out of the repo
+        os.chdir(workdir)
+        try:
+            modes = ['engine', 'api'] if args.mode == 'both' else [args.mode]
+            results = []
+            for index, mode in enumerate(modes):
+                # Fresh ids per mode so no run can reuse another run's output
+                first = index * (args.jobs + args.warmup)
+                warmup_jobs = build_jobs(scenarios, args.warmup, first)
+                jobs = build_jobs(scenarios, args.jobs, first + args.warmup)
+                # yt-dlp still draws its progress bar in quiet mode
+                with open(os.devnull, 'w') as devnull, \
+                        contextlib.redirect_stdout(sys.stdout if args.verbose else devnull), \
+                        contextlib.redirect_stderr(sys.stderr if args.verbose else devnull):
+                    result = run_mode(mode, jobs, warmup_jobs, args.concurrency, args)
+                results.append(result)
+                print_result(result)
+        finally:
+            os.chdir(previous_cwd)
+            if not args.keep_files:
+                shutil.rmtree(workdir, ignore_errors=True)
+        print(f'origin served {origin.requests_served} requests, '
+              f'{origin.bytes_served / (1024 * 1024):.1f} MB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    problems = check_thresholds(results, args, baseline)
+    for problem in problems:
+        print(f'FAIL: {problem}', file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Bulk download from the command line
+
+Runs a list of URLs through the same download engine as the web app (app.py's
+SocialMediaDownloader and run_download, so format policy, storage, progress
+and cancellation behave identically) without Flask or progress polling.
+Results are appended to a JSONL manifest; rerunning with --resume skips every
+URL the manifest already records as completed, unless its file has since gone
+missing or changed.
+
+    python cli.py urls.txt --workers 8 --manifest results.jsonl
+    cat urls.txt | python cli.py - --format audio --resume
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import app
+from utils import integrity, jobs
+from utils import storage as storages
+from utils.jobs import download_progress
+
+# Seconds between throughput lines on stderr
+SUMMARY_INTERVAL = 5
+
+
+def read_urls(source):
+    """URLs from a file or stdin ('-'): one per line, # comments allowed"""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def still_stored(entry):
+    """Whether a completed download's file is still there and unchanged"""
+    # Remote backends keep their own copy; local files are checked against the
+    # output manifest with a stat() instead of being read again
+    if not isinstance(app.storage, storages.LocalStorage):
+        return True
+    return integrity.intact(entry.get('file_path') or '') is not False
+
+
+def completed_in_manifest(path):
+    """(url, format) pairs a previous run finished whose files are still intact"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a truncated last line
+                continue
+            if entry.get('status') == 'completed' and still_stored(entry):
+                done.add((entry['url'], entry.get('format', 'best')))
+    return done
+
+
+def run_one(url, format_type):
+    """Download one URL through the web app's engine; returns a manifest entry"""
+    download_id = str(uuid.uuid4())
+    download_progress[download_id] = {'status': 'starting', 'progress': 0, 'url': url, 'format': format_type}
+    jobs.register(download_id, reap=False)
+    started = time.time()
+    try:
+        app.run_download(download_id, url, format_type)
+    finally:
+        state = download_progress.pop(download_id, {})
+    result = state.get('result') or {}
+    entry = {
+        'url': url,
+        'format': format_type,
+        'status': state.get('status'),
+        'download_id': download_id,
+        'elapsed': round(time.time() - started, 3),
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    if state.get('status') == 'completed':
+        entry.update({
+            'title': result.get('title'),
+            'file_path': result.get('file_path'),
+            'storage_key': result.get('storage_key'),
+            'sha256': result.get('sha256'),
+            'file_size': result.get('file_size'),
+            'media_count': result.get('media_count', 1),
+            'bytes': sum(item.get('size') or 0 for item in result['items']) if result.get('items')
+            else result.get('file_size') or 0,
+        })
+    else:
+        entry['error'] = state.get('error')
+    return entry
+
+
+class Summary:
+    def __init__(self, total):
+        self.total = total
+        self.started = time.time()
+        self.completed = self.failed = self.bytes = 0
+        self.last_print = self.started
+
+    def add(self, entry):
+        if entry['status'] == 'completed':
+            self.completed += 1
+            self.bytes += entry.get('bytes') or 0
+        elif entry['status'] == 'error':
+            self.failed += 1
+
+    def line(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        done = self.completed + self.failed
+        rate = done / elapsed
+        eta = (self.total - done) / rate if rate else 0
+        return (f"{done}/{self.total} done ({self.completed} ok, {self.failed} failed) | "
+                f"{rate * 60:.1f} URLs/min | {self.bytes / elapsed / 1024 ** 2:.2f} MB/s | "
+                f"ETA {eta / 60:.1f} min")
+
+    def maybe_print(self, force=False):
+        if force or time.time() - self.last_print >= SUMMARY_INTERVAL:
+            self.last_print = time.time()
+            print(self.line(), file=sys.stderr, flush=True)
+
+
+def run(urls, format_type, workers, manifest_path):
+    """Download urls with a pool of workers, appending results to the manifest"""
+    summary = Summary(len(urls))
+    pending = {}
+    todo = iter(urls)
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            open(manifest_path, 'a', encoding='utf-8') as manifest:
+        try:
+            while True:
+                # Keep the pool busy without queueing the whole list at once
+                for url in todo:
+                    pending[pool.submit(run_one, url, format_type)] = url
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, timeout=SUMMARY_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    del pending[future]
+                    entry = future.result()
+                    summary.add(entry)
+                    # Cancelled jobs are left out so --resume retries them
+                    if entry['status'] in ('completed', 'error'):
+                        manifest.write(json.dumps(entry) + '\n')
+                        manifest.flush()
+                summary.maybe_print()
+        except KeyboardInterrupt:
+            print("Interrupted, cancelling running downloads", file=sys.stderr)
+            for future in pending:
+                future.cancel()
+            for download_id in list(download_progress):
+                jobs.cancel(download_id, reason='cli interrupted')
+            raise
+        finally:
+            summary.maybe_print(force=True)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download a list of URLs without the web app')
+    parser.add_argument('source', help="file with one URL per line, or - for stdin")
+    parser.add_argument('--format', default='best', help='best, video_mp4, audio or image (default: best)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CONCURRENT_DOWNLOADS', 5)),
+                        help='parallel downloads (default: $CONCURRENT_DOWNLOADS or 5)')
+    parser.add_argument('--manifest', default='results.jsonl', help='JSONL results file (default: results.jsonl)')
+    parser.add_argument('--resume', action='store_true', help='skip URLs the manifest records as completed')
+    parser.add_argument('--verbose', action='store_true', help='log every download')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    done = completed_in_manifest(args.manifest) if args.resume else set()
+    urls, seen, skipped = [], set(), 0
+    for url in read_urls(args.source):
+        if (url, args.format) in done:
+            skipped += 1
+        elif url not in seen:
+            seen.add(url)
+            urls.append(url)
+    print(f"{len(urls)} URLs to download ({skipped} already completed)", file=sys.stderr)
+
+    try:
+        summary = run(urls, args.format, max(1, args.workers), args.manifest)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if summary.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,9 @@ import logging
 import requests
 from urllib.parse import urlparse, parse_qs
 
+from downloaders import format_policy, html_media, media_fetch
+from utils import clips, integrity, jobs, metrics, progress, sessions
+
 logger = logging.getLogger(__name__)
 
 class FacebookDownloader:
@@ -27,7 +30,7 @@ class FacebookDownloader:
                 'no_warnings': True,
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with sessions.cookie_jar('facebook', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=False)
                 return {
                     'title': info.get('title', 'Facebook Post'),
@@ -49,20 +52,21 @@ class FacebookDownloader:
                 'description': 'Facebook content'
             }
     
-    def download(self, url, format_type='best', download_id=None):
-        """Download Facebook content"""
+    def download(self, url, format_type='best', download_id=None, clip=None):
+        """Download Facebook content, or only the clip ({'start', 'end'} seconds) of a video"""
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 10
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
             
             # Configure yt-dlp options
             ydl_opts = {
-                'outtmpl': f'{self.downloads_dir}/facebook_%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/facebook_%(title)s{clips.filename_suffix(clip)}_{timestamp}.%(ext)s',
                 'quiet': True,
                 'no_warnings': True,
             }
@@ -80,32 +84,39 @@ class FacebookDownloader:
             else:
                 ydl_opts['format'] = 'best'
             
+            # Fetch only the fragments/byte ranges covering the clip
+            ydl_opts.update(clips.ydl_options(clip))
+            
+            # Cap size/resolution and prefer compatible codecs
+            format_policy.apply(ydl_opts)
+            
             # Add progress hook
             if download_id:
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        if 'total_bytes' in d:
-                            progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                            download_progress[download_id]['progress'] = min(progress, 90)
-                    elif d['status'] == 'finished':
-                        download_progress[download_id]['progress'] = 90
-                        download_progress[download_id]['status'] = 'processing'
-                
-                ydl_opts['progress_hooks'] = [progress_hook]
+                ydl_opts['progress_hooks'] = [progress.ydl_hook(download_id), jobs.cancel_hook(download_id)]
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl_opts['postprocessor_hooks'] = [metrics.postprocessor_hook('facebook')]
+            if download_id:
+                ydl_opts['postprocessor_hooks'].append(jobs.cancel_hook(download_id))
+            
+            with sessions.cookie_jar('facebook', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Get info first
-                info = ydl.extract_info(url, download=False)
+                with metrics.time_stage('facebook', 'extract'):
+                    info = ydl.extract_info(url, download=False)
+                jobs.check_cancelled(download_id)
                 title = info.get('title', 'Facebook Content')
                 
                 # Download
-                ydl.download([url])
+                with metrics.time_stage('facebook', 'transfer') as transfer:
+                    ydl.download([url])
                 
                 # Find the downloaded file
-                for file in os.listdir(self.downloads_dir):
+                with metrics.time_stage('facebook', 'discover'):
+                    matches = [f for f in os.listdir(downloads_dir) if timestamp in f]
+                for file in matches:
                     if timestamp in file and 'facebook' in file:
-                        file_path = os.path.join(self.downloads_dir, file)
+                        file_path = os.path.join(downloads_dir, file)
                         file_size = os.path.getsize(file_path)
+                        metrics.record_transfer('facebook', file_size, transfer.elapsed)
                         
                         # Update progress
                         if download_id:
@@ -117,7 +128,8 @@ class FacebookDownloader:
                             'file_path': file_path,
                             'filename': file,
                             'file_size': file_size,
-                            'format': format_type
+                            'format': format_type,
+                            'clip': clip
                         }
                 
                 raise Exception("Downloaded file not found")
@@ -135,45 +147,50 @@ class FacebookDownloader:
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 20
             
+            jobs.check_cancelled(download_id)
+            
             # Try to extract image URL from Facebook post
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
             
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            with metrics.time_stage('facebook', 'extract'):
+                # Stream the page only until og:image or embedded media is found
+                candidates = html_media.extract_media(url, headers, kinds=('image',))
+                img_urls = [c.url for c in candidates if not c.is_noise]
             
             # Update progress
             if download_id:
                 download_progress[download_id]['progress'] = 50
             
-            # Simple regex to find image URLs (this is a basic implementation)
-            import re
-            img_pattern = r'https://[^"]*\.(?:jpg|jpeg|png|gif)'
-            img_urls = re.findall(img_pattern, response.text)
-            
             if not img_urls:
                 raise Exception("No images found in Facebook post")
             
-            # Download the first image found
+            # Candidates are ranked by resolution, take the best one
             img_url = img_urls[0]
-            img_response = requests.get(img_url, headers=headers)
-            img_response.raise_for_status()
-            
-            # Update progress
-            if download_id:
-                download_progress[download_id]['progress'] = 80
-            
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
             filename = f"facebook_image_{timestamp}.jpg"
-            file_path = os.path.join(self.downloads_dir, filename)
-            
-            with open(file_path, 'wb') as f:
-                f.write(img_response.content)
+            file_path = os.path.join(downloads_dir, filename)
+            
+            jobs.check_cancelled(download_id)
+            jobs.track_file(download_id, file_path)
+            with metrics.time_stage('facebook', 'transfer') as transfer:
+                img_response = requests.get(img_url, headers=headers, stream=True, timeout=60)
+                try:
+                    img_response.raise_for_status()
+                    # Checked against what the server said it sent, so a cut-off body fails
+                    with integrity.StagedFile(file_path, integrity.expected_length(img_response)) as f:
+                        for chunk in img_response.iter_content(media_fetch.CHUNK_SIZE):
+                            jobs.check_cancelled(download_id)
+                            f.write(chunk)
+                finally:
+                    img_response.close()
+            metrics.record_transfer('facebook', f.size, transfer.elapsed)
             
             # Update progress
             if download_id:
@@ -184,7 +201,7 @@ class FacebookDownloader:
                 'title': 'Facebook Image',
                 'file_path': file_path,
                 'filename': filename,
-                'file_size': os.path.getsize(file_path),
+                'file_size': f.size,
                 'format': 'image'
             }
             
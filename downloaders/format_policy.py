@@ -0,0 +1,159 @@
+"""
+Format selection policy shared by the yt-dlp based downloaders
+Caps resolution and size, prefers device-friendly codecs and, in egress
+saver mode, picks the smallest format that still meets the requested
+quality, by adding filters to each downloader's format selector and a
+matching yt-dlp format_sort.
+
+Configuration (environment):
+    FORMAT_MAX_HEIGHT   highest video resolution to download, e.g. 1080
+    MAX_FILE_SIZE       largest file to download, e.g. 500MB
+    FORMAT_VCODEC       preferred video codec, e.g. h264 (for old devices)
+    FORMAT_ACODEC       preferred audio codec, e.g. aac
+    EGRESS_SAVER        true to prefer the smallest format at the capped quality
+    EGRESS_SAVER_HEIGHT resolution the saver aims for without FORMAT_MAX_HEIGHT
+                        (default 720)
+"""
+
+import os
+import re
+
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.I)
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+# Audio bitrate (kbps) the saver aims for; enough for the 192k MP3 we produce
+SAVER_AUDIO_KBPS = 160
+
+# Resolution the saver aims for when no cap is set; without one '+size' alone
+# would pick the smallest stream, often 144p
+SAVER_HEIGHT = int(os.environ.get('EGRESS_SAVER_HEIGHT', 720))
+
+
+def parse_size(value):
+    """Bytes from 524288000, "500MB", "1.5G" or "700MiB" """
+    if value in (None, ''):
+        return None
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+class FormatPolicy:
+    def __init__(self, max_height=None, max_bytes=None, vcodec=None, acodec=None, egress_saver=False):
+        self.max_height = max_height
+        self.max_bytes = max_bytes
+        self.vcodec = vcodec
+        self.acodec = acodec
+        self.egress_saver = egress_saver
+
+    @classmethod
+    def from_env(cls):
+        height = os.environ.get('FORMAT_MAX_HEIGHT')
+        return cls(
+            max_height=int(height) if height else None,
+            max_bytes=parse_size(os.environ.get('MAX_FILE_SIZE')),
+            vcodec=os.environ.get('FORMAT_VCODEC') or None,
+            acodec=os.environ.get('FORMAT_ACODEC') or None,
+            egress_saver=os.environ.get('EGRESS_SAVER', 'False').lower() == 'true',
+        )
+
+    @property
+    def active(self):
+        return bool(self.max_height or self.max_bytes or self.vcodec or self.acodec or self.egress_saver)
+
+    def _filters(self):
+        filters = ''
+        if self.max_height:
+            filters += f'[height<=?{self.max_height}]'
+        if self.max_bytes:
+            # Formats without a known size stay eligible; max_filesize stops them mid-way
+            filters += f'[filesize<?{self.max_bytes}][filesize_approx<?{self.max_bytes}]'
+        return filters
+
+    def selector(self, selector):
+        """Add the policy's filters to every alternative of a format selector"""
+        filters = self._filters()
+        if not filters:
+            return selector
+        return '/'.join(part + filters for part in selector.split('/'))
+
+    def allows(self, fmt):
+        """Whether a yt-dlp format dict passes the height and size caps"""
+        height = fmt.get('height')
+        if self.max_height and height and height > self.max_height:
+            return False
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if self.max_bytes and size and size > self.max_bytes:
+            return False
+        return True
+
+    def format_sort(self, audio_only=False):
+        """yt-dlp format_sort fields, most important first"""
+        fields = []
+        height = self.max_height or (SAVER_HEIGHT if self.egress_saver else None)
+        if height and not audio_only:
+            fields.append(f'res:{height}')
+        if self.vcodec and not audio_only:
+            fields.append(f'vcodec:{self.vcodec}')
+        if self.acodec:
+            fields.append(f'acodec:{self.acodec}')
+        if self.egress_saver:
+            if audio_only:
+                fields.append(f'abr:{SAVER_AUDIO_KBPS}')
+            fields += ['+size', '+br']
+        return fields
+
+    def apply(self, ydl_opts):
+        """Rewrite ydl_opts['format'] and add sorting/size limits in place"""
+        if not self.active:
+            return ydl_opts
+        selector = ydl_opts.get('format', 'best')
+        audio_only = selector.startswith('bestaudio')
+        ydl_opts['format'] = self.selector(selector)
+        format_sort = self.format_sort(audio_only)
+        if format_sort:
+            ydl_opts['format_sort'] = format_sort
+        if self.max_bytes:
+            ydl_opts['max_filesize'] = self.max_bytes
+        return ydl_opts
+
+    def to_dict(self):
+        return {
+            'max_height': self.max_height,
+            'max_bytes': self.max_bytes,
+            'vcodec': self.vcodec,
+            'acodec': self.acodec,
+            'egress_saver': self.egress_saver,
+        }
+
+
+def ladder(formats):
+    """Summarize a format list into one rung per resolution and video codec"""
+    rungs = {}
+    for fmt in formats:
+        vcodec = (fmt.get('vcodec') or 'none').split('.')[0]
+        key = (fmt.get('height') if vcodec != 'none' else None, vcodec)
+        rung = rungs.setdefault(key, {
+            'height': key[0],
+            'vcodec': vcodec,
+            'formats': 0,
+            'ext': [],
+            'min_filesize': None,
+            'max_filesize': None,
+            'within_policy': False,
+        })
+        rung['formats'] += 1
+        if fmt.get('ext') and fmt['ext'] not in rung['ext']:
+            rung['ext'].append(fmt['ext'])
+        size = fmt.get('filesize')
+        if size:
+            rung['min_filesize'] = min(rung['min_filesize'] or size, size)
+            rung['max_filesize'] = max(rung['max_filesize'] or size, size)
+        rung['within_policy'] = rung['within_policy'] or fmt.get('within_policy', True)
+    # Highest resolution first, audio-only last
+    return sorted(rungs.values(), key=lambda r: (r['height'] is None, -(r['height'] or 0), r['vcodec']))
+
+
+policy = FormatPolicy.from_env()
+apply = policy.apply
@@ -0,0 +1,274 @@
+"""
+Streaming media extraction from HTML pages
+Feeds the response into an HTML parser chunk by chunk and stops as soon as
+Open Graph / Twitter card tags or embedded JSON media have been found, instead
+of regex-scanning the whole page. Candidates are ranked by resolution so
+avatars and tracking pixels lose to the real media.
+"""
+
+import codecs
+import json
+import re
+from html.parser import HTMLParser
+
+import requests
+
+# Sources in order of trust when two candidates have the same resolution
+SOURCE_PRIORITY = {'og': 4, 'ld_json': 3, 'embedded_json': 3, 'twitter': 2, 'link': 1, 'img': 0}
+
+# URL fragments that mark avatars, emoji and tracking pixels
+NOISE_PATTERN = re.compile(r'profile_images|/avatar|emoji|pixel|/rsrc\.php|spacer|blank\.gif', re.I)
+
+# Named renditions used by pbs.twimg.com (name=...)
+TWITTER_RENDITIONS = {'orig': 4096, '4096x4096': 4096, 'large': 2048, 'medium': 1200,
+                      'small': 680, 'thumb': 150, 'tiny': 64}
+
+# Keys platforms use for media inside embedded JSON (Instagram, Facebook, Twitter)
+EMBEDDED_MEDIA_PATTERN = re.compile(
+    r'"(display_url|display_src|video_url|playable_url_quality_hd|playable_url|'
+    r'browser_native_hd_url|browser_native_sd_url|media_url_https)"\s*:\s*"((?:\\.|[^"\\])+)"'
+)
+VIDEO_KEYS = {'video_url', 'playable_url', 'playable_url_quality_hd',
+              'browser_native_hd_url', 'browser_native_sd_url'}
+
+CHUNK_SIZE = 16 * 1024
+
+
+class MediaCandidate:
+    def __init__(self, url, kind, source, width=None, height=None, index=0):
+        self.url = url
+        self.index = index
+        self.kind = kind
+        self.source = source
+        self.width = width
+        self.height = height
+
+    @property
+    def area(self):
+        width, height = self.width, self.height
+        if not (width and height):
+            width, height = _size_from_url(self.url)
+        return (width or 0) * (height or 0)
+
+    @property
+    def is_noise(self):
+        area = self.area
+        return bool(NOISE_PATTERN.search(self.url)) or (0 < area < 100 * 100)
+
+    def to_dict(self):
+        return {'url': self.url, 'kind': self.kind, 'source': self.source,
+                'width': self.width, 'height': self.height}
+
+    def __repr__(self):
+        return f"MediaCandidate({self.kind}, {self.source}, {self.width}x{self.height}, {self.url!r})"
+
+
+def _to_int(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _size_from_url(url):
+    """Guess the rendition size from CDN URL conventions"""
+    match = re.search(r'[?&]name=(\w+)', url)
+    if match and match.group(1) in TWITTER_RENDITIONS:
+        side = TWITTER_RENDITIONS[match.group(1)]
+        return side, side
+    # Facebook s720x720 / p960x960 path segments, generic 1200x900 names
+    match = re.search(r'(?:^|[/_.-])[sp]?(\d{2,5})x(\d{2,5})(?:[/_.?&-]|$)', url)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return None, None
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class MediaPageParser(HTMLParser):
+    """Collect media candidates and stop once the page has told us enough"""
+
+    def __init__(self, stop_at_head=True):
+        super().__init__(convert_charrefs=True)
+        self.stop_at_head = stop_at_head
+        self.candidates = []
+        self._last = {}
+        self._script_type = None
+        self._script_parts = []
+        self._in_head = True
+
+    def _add(self, url, kind, source, width=None, height=None):
+        if not url or not url.startswith(('http://', 'https://')):
+            return None
+        candidate = MediaCandidate(url, kind, source, _to_int(width), _to_int(height), len(self.candidates))
+        self.candidates.append(candidate)
+        return candidate
+
+    def _meta_candidates(self):
+        return [c for c in self.candidates if c.source in ('og', 'twitter', 'ld_json', 'embedded_json')]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'meta':
+            self._handle_meta(attrs.get('property') or attrs.get('name') or '', attrs.get('content'))
+        elif tag == 'link' and attrs.get('rel') == 'image_src':
+            self._add(attrs.get('href'), 'image', 'link')
+        elif tag == 'script':
+            self._script_type = (attrs.get('type') or 'text/javascript').lower()
+            self._script_parts = []
+        elif tag == 'body':
+            self._in_head = False
+            if self.stop_at_head and self._meta_candidates():
+                raise _StopParsing()
+        elif tag == 'img':
+            self._add(attrs.get('src'), 'image', 'img', attrs.get('width'), attrs.get('height'))
+        elif tag in ('video', 'source') and attrs.get('src'):
+            self._add(attrs.get('src'), 'video', 'img', attrs.get('width'), attrs.get('height'))
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self._in_head = False
+            if self.stop_at_head and self._meta_candidates():
+                raise _StopParsing()
+        elif tag == 'script' and self._script_type is not None:
+            script, kind = ''.join(self._script_parts), self._script_type
+            self._script_type = None
+            self._script_parts = []
+            found = self._handle_script(script, kind)
+            # Embedded JSON in the body is as good as it gets, stop reading
+            if found and not self._in_head:
+                raise _StopParsing()
+
+    def handle_data(self, data):
+        if self._script_type is not None:
+            self._script_parts.append(data)
+
+    def _handle_meta(self, key, content):
+        key = key.lower()
+        if key in ('og:image', 'og:image:url', 'og:image:secure_url'):
+            if not self._is_duplicate(content):
+                self._last['og:image'] = self._add(content, 'image', 'og')
+        elif key in ('og:video', 'og:video:url', 'og:video:secure_url'):
+            if not self._is_duplicate(content):
+                self._last['og:video'] = self._add(content, 'video', 'og')
+        elif key in ('og:image:width', 'og:image:height', 'og:video:width', 'og:video:height'):
+            target = self._last.get(key.rsplit(':', 1)[0])
+            if target is not None:
+                setattr(target, key.rsplit(':', 1)[1], _to_int(content))
+        elif key in ('twitter:image', 'twitter:image:src'):
+            self._add(content, 'image', 'twitter')
+        elif key == 'twitter:player:stream':
+            self._add(content, 'video', 'twitter')
+
+    def _is_duplicate(self, url):
+        return any(c.url == url for c in self.candidates)
+
+    def _handle_script(self, script, kind):
+        found = False
+        if kind == 'application/ld+json':
+            try:
+                data = json.loads(script)
+            except ValueError:
+                data = None
+            for item in (data if isinstance(data, list) else [data]):
+                if not isinstance(item, dict):
+                    continue
+                for key, media_kind in (('image', 'image'), ('video', 'video'), ('contentUrl', 'video')):
+                    for value in _as_list(item.get(key)):
+                        if isinstance(value, str):
+                            found |= self._add(value, media_kind, 'ld_json') is not None
+                        elif isinstance(value, dict):
+                            url = value.get('url') or value.get('contentUrl')
+                            found |= self._add(url, media_kind, 'ld_json',
+                                               value.get('width'), value.get('height')) is not None
+        else:
+            for key, raw in EMBEDDED_MEDIA_PATTERN.findall(script):
+                try:
+                    url = json.loads(f'"{raw}"')
+                except ValueError:
+                    continue
+                kind = 'video' if key in VIDEO_KEYS else 'image'
+                found |= self._add(url, kind, 'embedded_json') is not None
+        return found
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def rank_candidates(candidates, kinds=('image', 'video')):
+    """Best candidates first: wanted kind, real media, resolution, then source"""
+    seen = set()
+    unique = []
+    for candidate in candidates:
+        if candidate.kind in kinds and candidate.url not in seen:
+            seen.add(candidate.url)
+            unique.append(candidate)
+    return sorted(
+        unique,
+        key=lambda c: (not c.is_noise, c.area, SOURCE_PRIORITY.get(c.source, 0)),
+        reverse=True,
+    )
+
+
+def select_gallery(candidates, min_ratio=0.25):
+    """All media items of a post, in page order
+
+    Drops noise and thumbnails much smaller than the best rendition, and
+    collapses renditions of the same file (same URL without query string).
+    """
+    items = [c for c in candidates if not c.is_noise]
+    if not items:
+        return []
+    largest = max(c.area for c in items)
+    by_file = {}
+    for candidate in items:
+        if largest and candidate.area and candidate.area < largest * min_ratio:
+            continue
+        key = candidate.url.split('?')[0]
+        current = by_file.get(key)
+        if current is None or candidate.area > current.area:
+            by_file[key] = candidate
+    return sorted(by_file.values(), key=lambda c: c.index)
+
+
+def extract_from_chunks(chunks, kinds=('image', 'video'), stop_at_head=True):
+    """Parse decoded text chunks until the parser has enough candidates
+
+    With stop_at_head=False the parser keeps going past the card tags until
+    it finds embedded JSON media, e.g. to collect every item of a carousel.
+    """
+    parser = MediaPageParser(stop_at_head)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+    except _StopParsing:
+        pass
+    return rank_candidates(parser.candidates, kinds)
+
+
+def extract_from_html(text, kinds=('image', 'video'), stop_at_head=True, chunk_size=CHUNK_SIZE):
+    """Extract ranked media candidates from an already downloaded page"""
+    return extract_from_chunks(
+        (text[i:i + chunk_size] for i in range(0, len(text), chunk_size)), kinds, stop_at_head)
+
+
+def extract_media(url, headers=None, kinds=('image', 'video'), stop_at_head=True, session=None, timeout=30):
+    """Fetch a page and extract ranked media candidates, reading only as much as needed"""
+    http = session or requests
+    response = http.get(url, headers=headers, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        # requests falls back to ISO-8859-1 for text/* without a charset
+        charset_given = 'charset' in response.headers.get('Content-Type', '').lower()
+        encoding = response.encoding if charset_given and response.encoding else 'utf-8'
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        chunks = (decoder.decode(chunk) for chunk in response.iter_content(CHUNK_SIZE))
+        return extract_from_chunks(chunks, kinds, stop_at_head)
+    finally:
+        response.close()
@@ -11,20 +11,22 @@ import logging
 import requests
 import json
 
+from downloaders import media_fetch
+from utils import integrity, jobs, metrics, progress, sessions
+
 logger = logging.getLogger(__name__)
 
 class InstagramDownloader:
     def __init__(self):
         self.downloads_dir = 'downloads'
         os.makedirs(self.downloads_dir, exist_ok=True)
-        self.loader = instaloader.Instaloader(
-            download_videos=True,
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            compress_json=False
-        )
+        # Reuse saved logins instead of bootstrapping anonymously on every boot
+        self.sessions = sessions.instagram()
+    
+    @property
+    def loader(self):
+        # The session is loaded (or logged in) on first use, not at import
+        return self.sessions.ready()
     
     def get_info(self, url):
         """Get Instagram post information"""
@@ -48,6 +50,7 @@ class InstagramDownloader:
             }
         except Exception as e:
             logger.error(f"Error getting Instagram info: {str(e)}")
+            self.sessions.failed(e)
             raise
     
     def _extract_shortcode(self, url):
@@ -73,7 +76,7 @@ class InstagramDownloader:
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 10
             
@@ -82,75 +85,70 @@ class InstagramDownloader:
                 raise ValueError("Invalid Instagram URL")
             
             # Get post info
-            post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
+            with metrics.time_stage('instagram', 'extract'):
+                post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
+            jobs.check_cancelled(download_id)
             
             # Update progress
             if download_id:
                 download_progress[download_id]['progress'] = 30
             
+            # Every media item of the post, in carousel order
+            items = self._media_items(post)
+            
+            # Bytes, speed and items done, mapped onto 30-100%
+            reporter = progress.ProgressReporter(download_id, start=30, end=100)
+            
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_dir = tempfile.mkdtemp()
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
+            headers = {'User-Agent': self.loader.context.user_agent}
             
-            try:
-                # Set the download directory
-                self.loader.dirname_pattern = temp_dir
-                
-                # Download the post
-                self.loader.download_post(post, target=temp_dir)
-                
-                # Update progress
-                if download_id:
-                    download_progress[download_id]['progress'] = 80
-                
-                # Find downloaded files and move them to downloads directory
-                downloaded_files = []
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        if file.endswith(('.jpg', '.jpeg', '.png', '.mp4', '.mov')):
-                            src_path = os.path.join(root, file)
-                            # Create a meaningful filename
-                            ext = os.path.splitext(file)[1]
-                            new_filename = f"instagram_{post.owner_username}_{shortcode}_{timestamp}{ext}"
-                            dst_path = os.path.join(self.downloads_dir, new_filename)
-                            
-                            # Copy file to downloads directory
-                            import shutil
-                            shutil.copy2(src_path, dst_path)
-                            downloaded_files.append({
-                                'path': dst_path,
-                                'filename': new_filename,
-                                'size': os.path.getsize(dst_path)
-                            })
-                
-                if not downloaded_files:
-                    raise Exception("No media files found in post")
-                
-                # Update progress
-                if download_id:
-                    download_progress[download_id]['progress'] = 100
-                
-                # Return info about the first/main file
-                main_file = downloaded_files[0]
-                
-                return {
-                    'success': True,
-                    'title': f"Instagram post by @{post.owner_username}",
-                    'file_path': main_file['path'],
-                    'filename': main_file['filename'],
-                    'file_size': main_file['size'],
-                    'format': format_type,
-                    'all_files': downloaded_files
-                }
-                
-            finally:
-                # Clean up temp directory
-                import shutil
-                shutil.rmtree(temp_dir, ignore_errors=True)
+            # Fetch all items concurrently instead of one by one
+            with metrics.time_stage('instagram', 'transfer') as transfer:
+                manifest = media_fetch.fetch_media_items(
+                    items, downloads_dir, f"instagram_{post.owner_username}_{shortcode}_{timestamp}",
+                    headers=headers, progress=reporter, download_id=download_id)
+            
+            metrics.record_transfer('instagram', sum(item['size'] for item in manifest), transfer.elapsed)
+            
+            downloaded_files = [
+                {'path': item['path'], 'filename': item['filename'], 'size': item['size']}
+                for item in manifest
+            ]
+            
+            # The first item is the main file, the manifest lists all of them
+            main_file = downloaded_files[0]
+            self.sessions.used()
+            
+            return {
+                'success': True,
+                'title': f"Instagram post by @{post.owner_username}",
+                'file_path': main_file['path'],
+                'filename': main_file['filename'],
+                'file_size': main_file['size'],
+                'format': format_type,
+                'media_count': len(manifest),
+                'all_files': downloaded_files,
+                'items': manifest
+            }
                 
         except Exception as e:
             logger.error(f"Instagram download error: {str(e)}")
+            self.sessions.failed(e)
             raise Exception(f"Download failed: {str(e)}")
     
+    def _media_items(self, post):
+        """List the media URLs of a post, one per carousel slide"""
+        if post.typename == 'GraphSidecar':
+            return [
+                {'url': node.video_url if node.is_video else node.display_url,
+                 'kind': 'video' if node.is_video else 'image'}
+                for node in post.get_sidecar_nodes()
+            ]
+        if post.is_video:
+            return [{'url': post.video_url, 'kind': 'video'}]
+        return [{'url': post.url, 'kind': 'image'}]
+    
     def download_profile_pic(self, username):
         """Download profile picture"""
         try:
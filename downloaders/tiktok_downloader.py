@@ -11,6 +11,9 @@ import logging
 import requests
 import re
 
+from downloaders import format_policy
+from utils import integrity, jobs, metrics, progress, sessions
+
 logger = logging.getLogger(__name__)
 
 class TikTokDownloader:
@@ -27,7 +30,7 @@ class TikTokDownloader:
                 'no_warnings': True,
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with sessions.cookie_jar('tiktok', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=False)
                 return {
                     'title': info.get('title', 'TikTok Video'),
@@ -56,15 +59,16 @@ class TikTokDownloader:
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 10
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
             
             # Configure yt-dlp options
             ydl_opts = {
-                'outtmpl': f'{self.downloads_dir}/tiktok_%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/tiktok_%(title)s_{timestamp}.%(ext)s',
                 'quiet': True,
                 'no_warnings': True,
             }
@@ -82,32 +86,36 @@ class TikTokDownloader:
             else:  # best
                 ydl_opts['format'] = 'best'
             
+            # Cap size/resolution and prefer compatible codecs
+            format_policy.apply(ydl_opts)
+            
             # Add progress hook
             if download_id:
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        if 'total_bytes' in d:
-                            progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                            download_progress[download_id]['progress'] = min(progress, 90)
-                    elif d['status'] == 'finished':
-                        download_progress[download_id]['progress'] = 90
-                        download_progress[download_id]['status'] = 'processing'
-                
-                ydl_opts['progress_hooks'] = [progress_hook]
+                ydl_opts['progress_hooks'] = [progress.ydl_hook(download_id), jobs.cancel_hook(download_id)]
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl_opts['postprocessor_hooks'] = [metrics.postprocessor_hook('tiktok')]
+            if download_id:
+                ydl_opts['postprocessor_hooks'].append(jobs.cancel_hook(download_id))
+            
+            with sessions.cookie_jar('tiktok', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Get info first
-                info = ydl.extract_info(url, download=False)
+                with metrics.time_stage('tiktok', 'extract'):
+                    info = ydl.extract_info(url, download=False)
+                jobs.check_cancelled(download_id)
                 title = info.get('title', 'TikTok Video')
                 
                 # Download
-                ydl.download([url])
+                with metrics.time_stage('tiktok', 'transfer') as transfer:
+                    ydl.download([url])
                 
                 # Find the downloaded file
-                for file in os.listdir(self.downloads_dir):
+                with metrics.time_stage('tiktok', 'discover'):
+                    matches = [f for f in os.listdir(downloads_dir) if timestamp in f]
+                for file in matches:
                     if timestamp in file and 'tiktok' in file:
-                        file_path = os.path.join(self.downloads_dir, file)
+                        file_path = os.path.join(downloads_dir, file)
                         file_size = os.path.getsize(file_path)
+                        metrics.record_transfer('tiktok', file_size, transfer.elapsed)
                         
                         # Update progress
                         if download_id:
@@ -133,15 +141,16 @@ class TikTokDownloader:
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 10
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
             
             # Configure yt-dlp with specific options for watermark removal
             ydl_opts = {
-                'outtmpl': f'{self.downloads_dir}/tiktok_nowm_%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/tiktok_nowm_%(title)s_{timestamp}.%(ext)s',
                 'quiet': True,
                 'no_warnings': True,
                 'format': 'best[ext=mp4]/best',
@@ -152,32 +161,36 @@ class TikTokDownloader:
                 }]
             }
             
+            # Cap size/resolution and prefer compatible codecs
+            format_policy.apply(ydl_opts)
+            
             # Add progress hook
             if download_id:
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        if 'total_bytes' in d:
-                            progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                            download_progress[download_id]['progress'] = min(progress, 90)
-                    elif d['status'] == 'finished':
-                        download_progress[download_id]['progress'] = 90
-                        download_progress[download_id]['status'] = 'processing'
-                
-                ydl_opts['progress_hooks'] = [progress_hook]
+                ydl_opts['progress_hooks'] = [progress.ydl_hook(download_id), jobs.cancel_hook(download_id)]
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl_opts['postprocessor_hooks'] = [metrics.postprocessor_hook('tiktok')]
+            if download_id:
+                ydl_opts['postprocessor_hooks'].append(jobs.cancel_hook(download_id))
+            
+            with sessions.cookie_jar('tiktok', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Get info first
-                info = ydl.extract_info(url, download=False)
+                with metrics.time_stage('tiktok', 'extract'):
+                    info = ydl.extract_info(url, download=False)
+                jobs.check_cancelled(download_id)
                 title = info.get('title', 'TikTok Video')
                 
                 # Download
-                ydl.download([url])
+                with metrics.time_stage('tiktok', 'transfer') as transfer:
+                    ydl.download([url])
                 
                 # Find the downloaded file
-                for file in os.listdir(self.downloads_dir):
+                with metrics.time_stage('tiktok', 'discover'):
+                    matches = [f for f in os.listdir(downloads_dir) if timestamp in f]
+                for file in matches:
                     if timestamp in file and 'tiktok_nowm' in file:
-                        file_path = os.path.join(self.downloads_dir, file)
+                        file_path = os.path.join(downloads_dir, file)
                         file_size = os.path.getsize(file_path)
+                        metrics.record_transfer('tiktok', file_size, transfer.elapsed)
                         
                         # Update progress
                         if download_id:
@@ -196,5 +209,6 @@ class TikTokDownloader:
                 
         except Exception as e:
             logger.error(f"TikTok no-watermark download error: {str(e)}")
+            jobs.check_cancelled(download_id)
             # Fallback to regular download
             return self.download(url, 'best', download_id)
\ No newline at end of file
@@ -11,6 +11,9 @@ import logging
 import requests
 import re
 
+from downloaders import format_policy, html_media, media_fetch
+from utils import integrity, jobs, metrics, progress, sessions
+
 logger = logging.getLogger(__name__)
 
 class TwitterDownloader:
@@ -27,7 +30,7 @@ class TwitterDownloader:
                 'no_warnings': True,
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with sessions.cookie_jar('twitter', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=False)
                 return {
                     'title': info.get('title', 'Twitter Post'),
@@ -54,15 +57,16 @@ class TwitterDownloader:
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 10
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
             
             # Configure yt-dlp options
             ydl_opts = {
-                'outtmpl': f'{self.downloads_dir}/twitter_%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/twitter_%(title)s_{timestamp}.%(ext)s',
                 'quiet': True,
                 'no_warnings': True,
             }
@@ -80,32 +84,36 @@ class TwitterDownloader:
             else:
                 ydl_opts['format'] = 'best'
             
+            # Cap size/resolution and prefer compatible codecs
+            format_policy.apply(ydl_opts)
+            
             # Add progress hook
             if download_id:
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        if 'total_bytes' in d:
-                            progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                            download_progress[download_id]['progress'] = min(progress, 90)
-                    elif d['status'] == 'finished':
-                        download_progress[download_id]['progress'] = 90
-                        download_progress[download_id]['status'] = 'processing'
-                
-                ydl_opts['progress_hooks'] = [progress_hook]
+                ydl_opts['progress_hooks'] = [progress.ydl_hook(download_id), jobs.cancel_hook(download_id)]
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl_opts['postprocessor_hooks'] = [metrics.postprocessor_hook('twitter')]
+            if download_id:
+                ydl_opts['postprocessor_hooks'].append(jobs.cancel_hook(download_id))
+            
+            with sessions.cookie_jar('twitter', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Get info first
-                info = ydl.extract_info(url, download=False)
+                with metrics.time_stage('twitter', 'extract'):
+                    info = ydl.extract_info(url, download=False)
+                jobs.check_cancelled(download_id)
                 title = info.get('title', 'Twitter Content')
                 
                 # Download
-                ydl.download([url])
+                with metrics.time_stage('twitter', 'transfer') as transfer:
+                    ydl.download([url])
                 
                 # Find the downloaded file
-                for file in os.listdir(self.downloads_dir):
+                with metrics.time_stage('twitter', 'discover'):
+                    matches = [f for f in os.listdir(downloads_dir) if timestamp in f]
+                for file in matches:
                     if timestamp in file and 'twitter' in file:
-                        file_path = os.path.join(self.downloads_dir, file)
+                        file_path = os.path.join(downloads_dir, file)
                         file_size = os.path.getsize(file_path)
+                        metrics.record_transfer('twitter', file_size, transfer.elapsed)
                         
                         # Update progress
                         if download_id:
@@ -135,10 +143,12 @@ class TwitterDownloader:
         try:
             # Update progress
             if download_id:
-                from app import download_progress
+                from utils.jobs import download_progress
                 download_progress[download_id]['status'] = 'downloading'
                 download_progress[download_id]['progress'] = 20
             
+            jobs.check_cancelled(download_id)
+            
             # Extract tweet ID from URL
             tweet_id = self._extract_tweet_id(url)
             if not tweet_id:
@@ -153,46 +163,47 @@ class TwitterDownloader:
             if download_id:
                 download_progress[download_id]['progress'] = 40
             
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            with metrics.time_stage('twitter', 'extract'):
+                # Gallery images beyond the og:image card only appear in the body
+                candidates = html_media.extract_media(url, headers, kinds=('image',), stop_at_head=False)
+                gallery = [c for c in html_media.select_gallery(candidates) if '/media/' in c.url]
             
-            # Simple regex to find image URLs
-            img_pattern = r'https://pbs\.twimg\.com/media/[^"]*\.(?:jpg|jpeg|png|gif)'
-            img_urls = re.findall(img_pattern, response.text)
-            
-            if not img_urls:
+            if not gallery:
                 raise Exception("No images found in Twitter post")
             
-            # Download the first image found
-            img_url = img_urls[0]
-            # Remove any URL parameters and get high quality version
-            img_url = img_url.split('?')[0] + '?format=jpg&name=large'
+            items = []
+            for candidate in gallery:
+                img_url = candidate.url
+                if 'twimg.com' in img_url:
+                    # Remove any URL parameters and get high quality version
+                    img_url = img_url.split('?')[0] + '?format=jpg&name=large'
+                items.append({'url': img_url, 'kind': 'image'})
             
             # Update progress
             if download_id:
-                download_progress[download_id]['progress'] = 70
+                download_progress[download_id]['progress'] = 50
             
-            img_response = requests.get(img_url, headers=headers)
-            img_response.raise_for_status()
+            # Bytes, speed and items done, mapped onto 50-100%
+            reporter = progress.ProgressReporter(download_id, start=50, end=100)
             
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"twitter_image_{tweet_id}_{timestamp}.jpg"
-            file_path = os.path.join(self.downloads_dir, filename)
-            
-            with open(file_path, 'wb') as f:
-                f.write(img_response.content)
-            
-            # Update progress
-            if download_id:
-                download_progress[download_id]['progress'] = 100
-            
+            downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
+            with metrics.time_stage('twitter', 'transfer') as transfer:
+                manifest = media_fetch.fetch_media_items(
+                    items, downloads_dir, f"twitter_image_{tweet_id}_{timestamp}",
+                    headers=headers, progress=reporter, download_id=download_id)
+            metrics.record_transfer('twitter', sum(item['size'] for item in manifest), transfer.elapsed)
+            
+            main_file = manifest[0]
             return {
                 'success': True,
                 'title': f'Twitter Image from Tweet {tweet_id}',
-                'file_path': file_path,
-                'filename': filename,
-                'file_size': os.path.getsize(file_path),
-                'format': 'image'
+                'file_path': main_file['path'],
+                'filename': main_file['filename'],
+                'file_size': main_file['size'],
+                'format': 'image',
+                'media_count': len(manifest),
+                'items': manifest
             }
             
         except Exception as e:
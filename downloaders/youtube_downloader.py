@@ -9,6 +9,9 @@ import tempfile
 from datetime import datetime
 import logging
 
+from downloaders import format_policy
+from utils import clips, integrity, jobs, metrics, progress, sessions
+
 logger = logging.getLogger(__name__)
 
 class YouTubeDownloader:
@@ -23,7 +26,7 @@ class YouTubeDownloader:
             'no_warnings': True,
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with sessions.cookie_jar('youtube', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
             try:
                 info = ydl.extract_info(url, download=False)
                 return {
@@ -50,22 +53,26 @@ class YouTubeDownloader:
                         'format_id': fmt.get('format_id'),
                         'ext': fmt.get('ext'),
                         'quality': fmt.get('format_note', ''),
-                        'filesize': fmt.get('filesize'),
+                        'filesize': fmt.get('filesize') or fmt.get('filesize_approx'),
+                        'height': fmt.get('height'),
                         'vcodec': fmt.get('vcodec'),
-                        'acodec': fmt.get('acodec')
+                        'acodec': fmt.get('acodec'),
+                        'within_policy': format_policy.policy.allows(fmt)
                     })
         
         return formats
     
-    def download(self, url, format_type='best', download_id=None):
-        """Download YouTube video/audio"""
+    def download(self, url, format_type='best', download_id=None, clip=None):
+        """Download YouTube video/audio, or only the clip ({'start', 'end'} seconds)"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        downloads_dir = integrity.staging_dir(download_id, self.downloads_dir)
+        suffix = clips.filename_suffix(clip)
         
         # Configure yt-dlp options based on format
         if format_type == 'audio':
             ydl_opts = {
                 'format': 'bestaudio/best',
-                'outtmpl': f'{self.downloads_dir}/%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/%(title)s{suffix}_{timestamp}.%(ext)s',
                 'postprocessors': [{
                     'key': 'FFmpegExtractAudio',
                     'preferredcodec': 'mp3',
@@ -77,73 +84,80 @@ class YouTubeDownloader:
         elif format_type == 'video_mp4':
             ydl_opts = {
                 'format': 'best[ext=mp4]/best',
-                'outtmpl': f'{self.downloads_dir}/%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/%(title)s{suffix}_{timestamp}.%(ext)s',
                 'quiet': True,
                 'no_warnings': True,
             }
         else:  # best quality
             ydl_opts = {
                 'format': 'best',
-                'outtmpl': f'{self.downloads_dir}/%(title)s_{timestamp}.%(ext)s',
+                'outtmpl': f'{downloads_dir}/%(title)s{suffix}_{timestamp}.%(ext)s',
                 'quiet': True,
                 'no_warnings': True,
             }
         
+        # Fetch only the fragments/byte ranges covering the clip
+        ydl_opts.update(clips.ydl_options(clip))
+        
+        # Cap size/resolution and prefer compatible codecs
+        format_policy.apply(ydl_opts)
+        
         # Add progress hook if download_id provided
         if download_id:
-            def progress_hook(d):
-                from app import download_progress
-                if d['status'] == 'downloading':
-                    if 'total_bytes' in d:
-                        progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                        download_progress[download_id]['progress'] = progress
-                        download_progress[download_id]['status'] = 'downloading'
-                elif d['status'] == 'finished':
-                    download_progress[download_id]['progress'] = 100
-                    download_progress[download_id]['status'] = 'processing'
-            
-            ydl_opts['progress_hooks'] = [progress_hook]
+            ydl_opts['progress_hooks'] = [progress.ydl_hook(download_id), jobs.cancel_hook(download_id)]
+        
+        ydl_opts['postprocessor_hooks'] = [metrics.postprocessor_hook('youtube')]
+        if download_id:
+            ydl_opts['postprocessor_hooks'].append(jobs.cancel_hook(download_id))
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with sessions.cookie_jar('youtube', ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Get info first to get the title
-                info = ydl.extract_info(url, download=False)
+                with metrics.time_stage('youtube', 'extract'):
+                    info = ydl.extract_info(url, download=False)
+                jobs.check_cancelled(download_id)
                 title = info.get('title', 'Unknown')
                 
                 # Download the video
-                ydl.download([url])
+                with metrics.time_stage('youtube', 'transfer') as transfer:
+                    ydl.download([url])
                 
                 # Find the downloaded file
-                for file in os.listdir(self.downloads_dir):
-                    if timestamp in file and (title[:20] in file or file.startswith(title[:20])):
-                        file_path = os.path.join(self.downloads_dir, file)
+                with metrics.time_stage('youtube', 'discover'):
+                    for file in os.listdir(downloads_dir):
+                        if timestamp in file and (title[:20] in file or file.startswith(title[:20])):
+                            file_path = os.path.join(downloads_dir, file)
+                            file_size = os.path.getsize(file_path)
+                            metrics.record_transfer('youtube', file_size, transfer.elapsed)
+                            
+                            return {
+                                'success': True,
+                                'title': title,
+                                'file_path': file_path,
+                                'filename': file,
+                                'file_size': file_size,
+                                'format': format_type,
+                                'clip': clip
+                            }
+                    
+                    # If we can't find the file, return the latest file in downloads
+                    files = [f for f in os.listdir(downloads_dir) if timestamp in f]
+                    if files:
+                        latest_file = max(files, key=lambda x: os.path.getctime(os.path.join(downloads_dir, x)))
+                        file_path = os.path.join(downloads_dir, latest_file)
                         file_size = os.path.getsize(file_path)
+                        metrics.record_transfer('youtube', file_size, transfer.elapsed)
                         
                         return {
                             'success': True,
                             'title': title,
                             'file_path': file_path,
-                            'filename': file,
+                            'filename': latest_file,
                             'file_size': file_size,
-                            'format': format_type
+                            'format': format_type,
+                            'clip': clip
                         }
                 
-                # If we can't find the file, return the latest file in downloads
-                files = [f for f in os.listdir(self.downloads_dir) if timestamp in f]
-                if files:
-                    latest_file = max(files, key=lambda x: os.path.getctime(os.path.join(self.downloads_dir, x)))
-                    file_path = os.path.join(self.downloads_dir, latest_file)
-                    file_size = os.path.getsize(file_path)
-                    
-                    return {
-                        'success': True,
-                        'title': title,
-                        'file_path': file_path,
-                        'filename': latest_file,
-                        'file_size': file_size,
-                        'format': format_type
-                    }
-                
                 raise Exception("Downloaded file not found")
                 
         except Exception as e:
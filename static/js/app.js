@@ -25,6 +25,13 @@ class SocialMediaDownloader {
         urlInput.addEventListener('input', () => {
             this.detectPlatform();
         });
+
+        // Cancel an unfinished download when the page is closed
+        window.addEventListener('pagehide', () => {
+            if (this.currentDownloadId && this.progressInterval) {
+                fetch(`/api/download/${this.currentDownloadId}`, { method: 'DELETE', keepalive: true });
+            }
+        });
     }
 
     detectPlatform() {
@@ -77,7 +84,12 @@ class SocialMediaDownloader {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ url: url })
+                body: JSON.stringify({
+                    url: url,
+                    format: document.getElementById('formatSelect').value,
+                    // Only what displayContentInfo shows
+                    fields: 'title,uploader,username,duration,view_count,like_count,likes,thumbnail,description'
+                })
             });
 
             const data = await response.json();
@@ -175,6 +187,8 @@ class SocialMediaDownloader {
     async startDownload() {
         const url = document.getElementById('urlInput').value.trim();
         const format = document.getElementById('formatSelect').value;
+        const start = document.getElementById('clipStart').value.trim();
+        const end = document.getElementById('clipEnd').value.trim();
 
         if (!url) {
             this.showAlert('Please enter a valid URL', 'warning');
@@ -194,7 +208,9 @@ class SocialMediaDownloader {
                 },
                 body: JSON.stringify({ 
                     url: url,
-                    format: format 
+                    format: format,
+                    start: start || null,
+                    end: end || null
                 })
             });
 
@@ -241,7 +257,7 @@ class SocialMediaDownloader {
             if (response.ok) {
                 this.updateProgress(data);
                 
-                if (data.status === 'completed' || data.status === 'error') {
+                if (data.status === 'completed' || data.status === 'error' || data.status === 'cancelled') {
                     clearInterval(this.progressInterval);
                     this.progressInterval = null;
                 }
@@ -262,18 +278,39 @@ class SocialMediaDownloader {
         if (data.status === 'starting') {
             progressText.textContent = 'Initializing download...';
         } else if (data.status === 'downloading') {
-            progressText.textContent = `Downloading... ${Math.round(data.progress || 0)}%`;
+            progressText.textContent = this.describeTransfer(data);
         } else if (data.status === 'processing') {
             progressText.textContent = 'Processing file...';
         } else if (data.status === 'completed') {
             progressText.textContent = 'Download completed!';
             this.showDownloadResult(data.result);
+        } else if (data.status === 'cancelling') {
+            progressText.textContent = 'Cancelling...';
+        } else if (data.status === 'cancelled') {
+            progressText.textContent = 'Download cancelled';
         } else if (data.status === 'error') {
             progressText.textContent = 'Download failed!';
             this.showDownloadError(data.error);
         }
     }
 
+    describeTransfer(data) {
+        const parts = [`Downloading... ${Math.round(data.progress || 0)}%`];
+        if (data.total_bytes) {
+            const prefix = data.total_is_estimate ? '~' : '';
+            parts.push(`${this.formatFileSize(data.downloaded_bytes || 0)} of ${prefix}${this.formatFileSize(data.total_bytes)}`);
+        } else if (data.fragment_count) {
+            parts.push(`fragment ${data.fragment_index || 0}/${data.fragment_count}`);
+        }
+        if (data.speed) {
+            parts.push(`${this.formatFileSize(data.speed)}/s`);
+        }
+        if (data.eta) {
+            parts.push(`${this.formatDuration(data.eta)} left`);
+        }
+        return parts.join(' · ');
+    }
+
     showDownloadResult(result) {
         const downloadResult = document.getElementById('downloadResult');
         
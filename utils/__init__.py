@@ -0,0 +1,3 @@
+"""
+Shared helpers used by the Flask app and the platform downloaders
+"""
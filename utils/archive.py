@@ -0,0 +1,70 @@
+"""
+Streaming ZIP archives
+Builds a ZIP of already downloaded files on the fly, yielding it chunk by
+chunk, so multi-item posts can be served as one download without writing a
+second copy to disk or holding the archive in memory.
+"""
+
+import io
+import os
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _StreamSink(io.RawIOBase):
+    """Unseekable file object that hands written bytes to the generator"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_zip(files):
+    """Yield a ZIP archive of (path, arcname) pairs
+
+    Media is already compressed, so entries are stored rather than deflated.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for path, arcname in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def archive_name(files, fallback='download'):
+    """Archive filename derived from the first file"""
+    if not files:
+        return f"{fallback}.zip"
+    stem = os.path.splitext(os.path.basename(files[0][1]))[0]
+    return f"{stem.rsplit('_', 1)[0] if stem[-2:].isdigit() else stem}.zip"
@@ -0,0 +1,129 @@
+"""
+Fingerprinted, precompressed static assets
+`python -m utils.assets` copies every file under static/ to static/dist/ with a
+content hash in its name (css/style.css -> css/style.3f9a1c0d2b7e.css), next
+to .gz and, when the brotli package is installed, .br variants, and writes
+static/dist/manifest.json mapping the source names to the hashed ones.
+
+Templates link assets with asset_url('css/style.css'), which resolves to the
+hashed file under /assets/. Those URLs change whenever the content does, so
+they are served with a one-year immutable Cache-Control and browsers never
+revalidate them; a reverse proxy can serve static/dist/ directly (see the
+README). Without a build, asset_url falls back to the plain /static/ URL.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+from flask import abort, request, send_from_directory, url_for
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Types worth compressing; images and fonts are already compressed
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Precompressed variants by preference, with their Content-Encoding
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build(static_dir=STATIC_DIR):
+    """Fingerprint and precompress static_dir into static_dir/dist; returns the manifest"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        logger.warning("brotli is not installed, building gzip variants only")
+
+    out_dir = os.path.join(static_dir, DIST)
+    # Rebuilt from scratch so assets that were removed do not linger
+    shutil.rmtree(out_dir, ignore_errors=True)
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        if os.path.abspath(dirpath) == os.path.abspath(static_dir):
+            dirnames[:] = [d for d in dirnames if d != DIST]
+        for filename in sorted(filenames):
+            source = os.path.join(dirpath, filename)
+            name = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            hashed = _fingerprint(name, data)
+            target = os.path.join(out_dir, hashed)
+            _write(target, data)
+            if name.endswith(COMPRESSIBLE):
+                # mtime=0 keeps the .gz identical across builds
+                variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+                if brotli is not None:
+                    variants.append(('.br', brotli.compress(data, quality=11)))
+                for suffix, compressed in variants:
+                    if len(compressed) < len(data):
+                        _write(target + suffix, compressed)
+            manifest[name] = hashed
+    _write(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    """{source name: hashed name} of the last build, empty without one"""
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+manifest = load_manifest()
+
+
+def asset_url(filename):
+    """URL of a static asset, fingerprinted if it has been built"""
+    hashed = manifest.get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=hashed)
+
+
+def serve(filename, static_dir=STATIC_DIR):
+    """Response for a fingerprinted asset, precompressed if the client accepts it"""
+    directory = os.path.join(static_dir, DIST)
+    if filename == MANIFEST or filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+        abort(404)
+    # Type of the asset itself, not of the compressed file
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in ENCODINGS:
+        if encoding in request.accept_encodings and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
+    built = build()
+    print(f"Built {len(built)} assets into {os.path.join(STATIC_DIR, DIST)}")
@@ -0,0 +1,58 @@
+"""
+Time-range clips
+Parses the start/end of a clip request and turns it into yt-dlp options that
+download only the covering part of the media instead of the whole file.
+"""
+
+import re
+
+from yt_dlp.utils import download_range_func
+
+TIMESTAMP_PATTERN = re.compile(r'^(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)$')
+
+
+def parse_time(value):
+    """Seconds from 90, 90.5, "1:30" or "01:01:30.250" """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        match = TIMESTAMP_PATTERN.match(str(value).strip())
+        if not match:
+            raise ValueError(f"Invalid time: {value}")
+        hours, minutes, secs = match.groups()
+        seconds = int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(secs)
+    if seconds < 0:
+        raise ValueError(f"Invalid time: {value}")
+    return seconds
+
+
+def parse_clip(start=None, end=None):
+    """{'start', 'end'} in seconds, or None when no range was asked for"""
+    start, end = parse_time(start), parse_time(end)
+    if start is None and end is None:
+        return None
+    start = start or 0.0
+    if end is not None and end <= start:
+        raise ValueError("Clip end must be after its start")
+    return {'start': start, 'end': end}
+
+
+def ydl_options(clip):
+    """yt-dlp options that fetch only the clip, cut at keyframes"""
+    if not clip:
+        return {}
+    end = clip['end'] if clip.get('end') is not None else float('inf')
+    return {
+        'download_ranges': download_range_func(None, [(clip['start'], end)]),
+        'force_keyframes_at_cuts': True,
+    }
+
+
+def filename_suffix(clip):
+    """e.g. _clip90-120 for a clip from 1:30 to 2:00"""
+    if not clip:
+        return ''
+    end = '' if clip.get('end') is None else f"{clip['end']:g}"
+    return f"_clip{clip['start']:g}-{end}"
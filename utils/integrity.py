@@ -0,0 +1,315 @@
+"""
+Crash-safe, integrity-checked output commits
+A job writes into its own staging directory (downloads/.staging/<job id>), so
+a crashed or concurrent job can never leave a half-written file where serving
+or resume logic would pick it up. Files the app writes itself go through
+StagedFile, which hashes and counts the bytes as they are written and checks
+them against the expected length; files written by yt-dlp (which checks the
+Content-Length itself) are hashed once when they are committed, unless they
+are larger than HASH_MAX_SIZE, which would cost a second full read. Committing
+fsyncs each file, moves it into downloads/ with an atomic no-clobber rename and
+appends a record of its size, mtime and SHA-256 to the output manifest.
+
+intact(path) then tells whether a file on disk is still the one that was
+committed from a stat() alone, without reading it again.
+
+Configuration (environment):
+    OUTPUT_MANIFEST      manifest of committed files (default downloads/manifest.jsonl)
+    STAGING_MAX_AGE      seconds after which staging directories left by a
+                         crashed process are removed at startup (default one day)
+    HASH_MAX_SIZE        largest yt-dlp output that is read back for its sha256,
+                         e.g. 1GB (default 256MB, 0 = no limit)
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from downloaders.format_policy import parse_size
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.environ.get('OUTPUT_MANIFEST', os.path.join('downloads', 'manifest.jsonl'))
+STAGING_MAX_AGE = float(os.environ.get('STAGING_MAX_AGE', 24 * 3600))
+HASH_MAX_SIZE = parse_size(os.environ.get('HASH_MAX_SIZE', '256MB')) or 0
+
+STAGING = '.staging'
+CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+# (size, sha256) of staged files written through StagedFile, by path
+_digests = {}
+# Manifest records by path, and how far the manifest has been read
+_index = {}
+_index_offset = 0
+
+
+class IntegrityError(Exception):
+    """Raised when a written file does not match its expected length"""
+
+
+def staging_dir(download_id, downloads_dir='downloads'):
+    """Directory a job writes its files into; downloads_dir itself outside a job"""
+    if download_id is None:
+        return downloads_dir
+    path = os.path.join(downloads_dir, STAGING, download_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _committed_dir(path):
+    """downloads directory a staged file belongs in, None if it is not staged"""
+    staging = os.path.dirname(os.path.dirname(os.path.normpath(path)))
+    if os.path.basename(staging) != STAGING:
+        return None
+    return os.path.dirname(staging) or '.'
+
+
+def expected_length(response):
+    """Body length a requests response announced, None if unknown or encoded"""
+    # Content-Length counts the encoded body, iter_content yields it decoded
+    length = response.headers.get('Content-Length')
+    if not length or response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    try:
+        return int(length)
+    except ValueError:
+        return None
+
+
+class StagedFile:
+    """Binary file that hashes and counts what is written to it
+
+    Closing it checks the length against expected_size (if known), fsyncs and
+    remembers the digest for commit_result.
+    """
+
+    def __init__(self, path, expected_size=None):
+        self.path = path
+        self.expected_size = expected_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if self.expected_size is not None and self.size != self.expected_size:
+            raise IntegrityError(f"{os.path.basename(self.path)} is truncated: "
+                                 f"got {self.size} of {self.expected_size} bytes")
+        if _committed_dir(self.path) is not None:
+            with _lock:
+                _digests[os.path.abspath(self.path)] = (self.size, self.sha256)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def hash_file(path, max_size=0):
+    """(size, sha256) of a file, fsyncing it on the way
+
+    Files larger than max_size (if set) are only fsynced, with a None sha256.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        if max_size and os.fstat(f.fileno()).st_size > max_size:
+            os.fsync(f.fileno())
+            return os.fstat(f.fileno()).st_size, None
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        os.fsync(f.fileno())
+    return size, digest.hexdigest()
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _publish(src, dst, download_id):
+    """Atomically move src to dst without replacing an existing file; returns the path used"""
+    stem, ext = os.path.splitext(dst)
+    for candidate in (dst, f"{stem}_{download_id[:8]}{ext}", f"{stem}_{download_id}{ext}"):
+        try:
+            os.link(src, candidate)
+        except FileExistsError:
+            continue
+        except OSError as e:
+            # File systems without hard links: check, then rename
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV) or os.path.exists(candidate):
+                raise
+            os.replace(src, candidate)
+            return candidate
+        os.remove(src)
+        return candidate
+    raise Exception(f"No free file name for {os.path.basename(dst)}")
+
+
+def _append_manifest(records):
+    os.makedirs(os.path.dirname(MANIFEST_PATH) or '.', exist_ok=True)
+    data = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+    # One O_APPEND write per commit, so concurrent workers' records never interleave
+    fd = os.open(MANIFEST_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit_result(download_id, result):
+    """Verify and move every staged file of a result into place
+
+    Updates the result's paths (and filenames, if a name was taken) and adds
+    each file's sha256. Raises IntegrityError if a file is empty or changed
+    size since it was written.
+    """
+    committed = {}
+    records = []
+    for entry in (result.get('items') or []) + (result.get('all_files') or []) + [result]:
+        path = entry.get('path') or entry.get('file_path')
+        if not path:
+            continue
+        if path not in committed:
+            target_dir = _committed_dir(path)
+            if target_dir is None:
+                committed[path] = None
+                continue
+            with _lock:
+                written = _digests.pop(os.path.abspath(path), None)
+            size = os.path.getsize(path)
+            if written is None:
+                written = hash_file(path, HASH_MAX_SIZE)
+            elif written[0] != size:
+                raise IntegrityError(f"{os.path.basename(path)} changed size after it was written")
+            if not size:
+                raise IntegrityError(f"{os.path.basename(path)} is empty")
+            final = _publish(path, os.path.join(target_dir, os.path.basename(path)), download_id)
+            committed[path] = (final, size, written[1])
+            records.append({
+                'path': os.path.normpath(final),
+                'size': size,
+                'mtime_ns': os.stat(final).st_mtime_ns,
+                'sha256': written[1],
+                'download_id': download_id,
+                'committed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            })
+        if committed[path] is None:
+            continue
+        final, size, sha256 = committed[path]
+        entry['path' if 'path' in entry else 'file_path'] = final
+        entry['filename'] = os.path.basename(final)
+        entry['sha256'] = sha256
+    if records:
+        _fsync_dir(os.path.dirname(records[0]['path']) or '.')
+        _append_manifest(records)
+    return result
+
+
+def discard(download_id, downloads_dir='downloads'):
+    """Remove whatever a job left in its staging directory"""
+    if download_id is None:
+        return
+    path = os.path.join(downloads_dir, STAGING, download_id)
+    prefix = os.path.abspath(path) + os.sep
+    with _lock:
+        for staged in [p for p in _digests if p.startswith(prefix)]:
+            del _digests[staged]
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def clean_staging(downloads_dir='downloads', max_age=None):
+    """Remove staging directories of jobs that died with their process"""
+    root = os.path.join(downloads_dir, STAGING)
+    max_age = STAGING_MAX_AGE if max_age is None else max_age
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} abandoned staging director{'y' if removed == 1 else 'ies'}")
+    return removed
+
+
+def _refresh_index():
+    """Read manifest records appended since the last call"""
+    global _index_offset
+    try:
+        with open(MANIFEST_PATH, 'rb') as f:
+            f.seek(_index_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Another process is mid-append, read it next time
+                    break
+                _index_offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                _index[record['path']] = record
+    except FileNotFoundError:
+        pass
+
+
+def record(path):
+    """Manifest record of a committed file, or None"""
+    with _lock:
+        _refresh_index()
+        return _index.get(os.path.normpath(path))
+
+
+def intact(path):
+    """Whether a committed file is unchanged, judged by stat() alone
+
+    None if the file was never committed (e.g. older downloads), False if it
+    is missing or its size or mtime differ from the manifest.
+    """
+    entry = record(path)
+    if entry is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']
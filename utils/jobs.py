@@ -0,0 +1,146 @@
+"""
+Download job state and cancellation
+Holds the shared progress table, per-job cancel flags and the files a job has
+started writing. Cancellation is cooperative: downloaders call
+check_cancelled() from their yt-dlp hooks and transfer loops, and the job's
+partial files are removed once it has stopped.
+
+Jobs nobody has polled for JOB_IDLE_TIMEOUT seconds (default 120, 0 disables)
+are cancelled automatically by a background reaper.
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Global download progress tracking, keyed by download id
+download_progress = {}
+
+IDLE_TIMEOUT = float(os.environ.get('JOB_IDLE_TIMEOUT', 120))
+REAP_INTERVAL = 5
+
+# States in which a job still holds a worker
+ACTIVE_STATES = ('starting', 'downloading', 'processing')
+
+# Suffixes yt-dlp uses for in-progress files
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+_lock = threading.Lock()
+_cancelled = {}
+_last_seen = {}
+_files = {}
+_reaper = None
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled"""
+
+
+def register(download_id, reap=True):
+    """Start tracking a job; reap=False exempts it from idle cancellation"""
+    with _lock:
+        _cancelled.pop(download_id, None)
+        _files.setdefault(download_id, set())
+        if reap:
+            _last_seen[download_id] = time.monotonic()
+    if reap:
+        _start_reaper()
+
+
+def touch(download_id):
+    """Note that a client is still interested in the job"""
+    with _lock:
+        if download_id in _last_seen:
+            _last_seen[download_id] = time.monotonic()
+
+
+def cancel(download_id, reason='cancelled by client'):
+    """Flag a job for cancellation; returns False if it is not running"""
+    progress = download_progress.get(download_id)
+    if progress is None or progress.get('status') not in ACTIVE_STATES + ('cancelling',):
+        return False
+    with _lock:
+        _cancelled.setdefault(download_id, reason)
+    progress['status'] = 'cancelling'
+    logger.info(f"Cancelling download {download_id}: {reason}")
+    return True
+
+
+def is_cancelled(download_id):
+    return download_id is not None and download_id in _cancelled
+
+
+def check_cancelled(download_id):
+    """Raise JobCancelled if the job has been cancelled"""
+    if download_id is not None and download_id in _cancelled:
+        raise JobCancelled(_cancelled[download_id])
+
+
+def cancel_hook(download_id):
+    """yt-dlp progress/postprocessor hook that aborts a cancelled job"""
+    def hook(d):
+        if d.get('status') == 'downloading':
+            track_file(download_id, d.get('tmpfilename'))
+            track_file(download_id, d.get('filename'))
+        check_cancelled(download_id)
+    return hook
+
+
+def track_file(download_id, path):
+    """Remember a file the job writes so it can be removed on cancel"""
+    if download_id is None or not path:
+        return
+    with _lock:
+        files = _files.get(download_id)
+        if files is not None:
+            files.add(path)
+
+
+def remove_files(download_id):
+    """Delete the files (and yt-dlp leftovers) a job has written"""
+    with _lock:
+        files = _files.get(download_id, set())
+        _files[download_id] = set()
+    removed = 0
+    for path in files:
+        for candidate in [path] + [path + s for s in PARTIAL_SUFFIXES] + glob.glob(glob.escape(path) + '.part-Frag*'):
+            try:
+                os.remove(candidate)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def finish(download_id):
+    """Stop tracking a job that has finished, failed or been cancelled"""
+    with _lock:
+        _last_seen.pop(download_id, None)
+        _files.pop(download_id, None)
+        _cancelled.pop(download_id, None)
+
+
+def _reap():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        now = time.monotonic()
+        with _lock:
+            idle = [job_id for job_id, seen in _last_seen.items() if now - seen > IDLE_TIMEOUT]
+        for job_id in idle:
+            if cancel(job_id, reason=f'not polled for {IDLE_TIMEOUT:.0f}s'):
+                with _lock:
+                    _last_seen.pop(job_id, None)
+
+
+def _start_reaper():
+    global _reaper
+    if IDLE_TIMEOUT <= 0:
+        return
+    with _lock:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reap, name='job-reaper', daemon=True)
+            _reaper.start()
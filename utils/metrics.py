@@ -0,0 +1,268 @@
+"""
+Prometheus-style metrics for the downloader
+Keeps counters, gauges and histograms in process and renders them in the
+Prometheus text exposition format for the /metrics endpoint
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import tracing
+
+# Latency buckets in seconds, from fast metadata lookups to multi-minute transfers
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Throughput buckets in bytes/sec, from 64 KB/s up to 256 MB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(8))
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}',
+        ]
+        for sample_name, key, extra, value in self._samples():
+            labels = _format_labels(self.labelnames, key, extra)
+            lines.append(f'{sample_name}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Compute the (unlabelled) gauge value at scrape time"""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [(self.name, (), None, self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', key, ('le', _format_value(bound)), cumulative))
+                samples.append((f'{self.name}_sum', key, None, state['sum']))
+                samples.append((f'{self.name}_count', key, None, state['count']))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+JOBS_TOTAL = registry.counter(
+    'downloader_jobs_total', 'Download jobs finished, by platform and outcome',
+    ['platform', 'status'])
+JOB_DURATION = registry.histogram(
+    'downloader_job_duration_seconds', 'End-to-end download_content latency',
+    ['platform', 'status'])
+STAGE_DURATION = registry.histogram(
+    'downloader_stage_duration_seconds',
+    'Time spent per download stage (extract, transfer, postprocess, discover)',
+    ['platform', 'stage'])
+TRANSFER_RATE = registry.histogram(
+    'downloader_transfer_bytes_per_second', 'Observed transfer throughput per job',
+    ['platform'], buckets=THROUGHPUT_BUCKETS)
+BYTES_TOTAL = registry.counter(
+    'downloader_bytes_total', 'Bytes written to the downloads directory',
+    ['platform'])
+ERRORS_TOTAL = registry.counter(
+    'downloader_errors_total', 'Failed download jobs, by platform and exception type',
+    ['platform', 'exception'])
+ACTIVE_JOBS = registry.gauge(
+    'downloader_active_jobs', 'Download jobs currently running',
+    ['platform'])
+QUEUE_DEPTH = registry.gauge(
+    'downloader_queue_depth', 'Download jobs accepted but not yet running')
+CACHE_REQUESTS = registry.counter(
+    'downloader_cache_requests_total', 'Cache lookups, by cache and result (hit/miss)',
+    ['cache', 'result'])
+SUBSCRIPTION_POLLS = registry.counter(
+    'downloader_subscription_polls_total',
+    'Subscription source polls, by platform and result (new, unchanged, not_modified, deferred, error)',
+    ['platform', 'result'])
+SUBSCRIPTION_ITEMS = registry.counter(
+    'downloader_subscription_items_total', 'New items enqueued from subscriptions',
+    ['platform'])
+
+
+class StageTimer:
+    """Elapsed time of a finished (or running) stage"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def elapsed(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+@contextmanager
+def time_stage(platform, stage):
+    """Time a block of work and record it under the given platform/stage
+
+    The stage is also traced as a span of the current job, if there is one.
+    """
+    timer = StageTimer()
+    with tracing.span(stage, platform=platform):
+        try:
+            yield timer
+        finally:
+            timer.end = time.perf_counter()
+            STAGE_DURATION.observe(timer.elapsed, platform=platform, stage=stage)
+
+
+def record_transfer(platform, num_bytes, seconds):
+    """Record bytes written by a job and the throughput it achieved"""
+    if not num_bytes:
+        return
+    BYTES_TOTAL.inc(num_bytes, platform=platform)
+    if seconds > 0:
+        TRANSFER_RATE.observe(num_bytes / seconds, platform=platform)
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup so hit rates can be derived from the metrics"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def exception_name(exc):
+    """Name of the innermost exception, since downloaders re-wrap failures"""
+    while exc.__cause__ is not None or exc.__context__ is not None:
+        exc = exc.__cause__ or exc.__context__
+    return type(exc).__name__
+
+
+def postprocessor_hook(platform):
+    """Build a yt-dlp postprocessor hook that times FFmpeg post-processing"""
+    started = {}
+
+    def hook(d):
+        name = d.get('postprocessor', 'unknown')
+        if d['status'] == 'started':
+            started[name] = (time.perf_counter(), time.time_ns())
+        elif d['status'] == 'finished' and name in started:
+            start, start_ns = started.pop(name)
+            STAGE_DURATION.observe(time.perf_counter() - start, platform=platform, stage='postprocess')
+            tracing.record('postprocess', start_ns, time.time_ns(), platform=platform, postprocessor=name)
+
+    return hook
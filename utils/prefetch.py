@@ -0,0 +1,105 @@
+"""
+Speculative prefetch
+The web UI asks /api/info for a URL and usually calls /api/download for the
+same URL seconds later. With SPECULATIVE_PREFETCH=true a successful info
+lookup starts downloading the format the client has selected right away; a
+matching /api/download then takes over that job instead of starting a new one,
+and a job nobody claims within PREFETCH_WINDOW seconds is cancelled and its
+files removed.
+
+Speculation only uses spare capacity: it is skipped while CONCURRENT_DOWNLOADS
+client jobs are running, at most PREFETCH_MAX_JOBS speculative jobs run at
+once, and media longer than PREFETCH_MAX_DURATION seconds is not prefetched.
+A prefetch is billed to the client whose lookup triggered it.
+"""
+
+import logging
+import os
+import threading
+import uuid
+
+from utils import jobs, metrics
+from utils.jobs import download_progress
+
+logger = logging.getLogger(__name__)
+
+# States after which a speculative job can no longer be handed to a client
+DEAD_STATES = ('error', 'cancelling', 'cancelled')
+
+
+class Prefetcher:
+    def __init__(self, start, discard, window=30, max_jobs=2, max_duration=1800, max_active=5):
+        self.start = start
+        self.discard = discard
+        self.window = window
+        self.max_jobs = max_jobs
+        self.max_duration = max_duration
+        self.max_active = max_active
+        # (url, format) -> download id of the unclaimed speculative job
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, start, discard):
+        """A prefetcher if SPECULATIVE_PREFETCH is enabled, else None"""
+        if os.environ.get('SPECULATIVE_PREFETCH', 'False').lower() != 'true':
+            return None
+        return cls(start, discard,
+                   window=float(os.environ.get('PREFETCH_WINDOW', 30)),
+                   max_jobs=int(os.environ.get('PREFETCH_MAX_JOBS', 2)),
+                   max_duration=float(os.environ.get('PREFETCH_MAX_DURATION', 1800)),
+                   max_active=int(os.environ.get('CONCURRENT_DOWNLOADS', 5)))
+
+    def _busy(self):
+        active = [p for p in list(download_progress.values())
+                  if p.get('status') in jobs.ACTIVE_STATES and not p.get('speculative')]
+        return len(active) >= self.max_active
+
+    def speculate(self, url, format_type='best', info=None, client=None):
+        """Start fetching url after client's info lookup; returns the job id or None"""
+        duration = (info or {}).get('duration') or 0
+        if self.max_duration and duration > self.max_duration:
+            return None
+        key = (url, format_type)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            running = sum(1 for download_id in self._pending.values()
+                          if download_progress.get(download_id, {}).get('status') in jobs.ACTIVE_STATES)
+            if running >= self.max_jobs or self._busy():
+                return None
+            download_id = str(uuid.uuid4())
+            self._pending[key] = download_id
+        self.start(download_id, url, format_type, speculative=True, client=client)
+        timer = threading.Timer(self.window, self._expire, args=(key, download_id))
+        timer.daemon = True
+        timer.start()
+        logger.info(f"Prefetching {url} ({format_type}) as {download_id}")
+        return download_id
+
+    def claim(self, url, format_type='best', clip=None):
+        """Id of a live speculative job for this request, now owned by the client"""
+        if clip:
+            return None
+        with self._lock:
+            download_id = self._pending.pop((url, format_type), None)
+        progress = download_progress.get(download_id) if download_id else None
+        hit = progress is not None and progress.get('status') not in DEAD_STATES
+        metrics.record_cache('prefetch', hit)
+        if not hit:
+            return None
+        progress.pop('speculative', None)
+        # From here on it is an ordinary job, cancelled if the client goes away
+        if progress.get('status') in jobs.ACTIVE_STATES:
+            jobs.register(download_id)
+        logger.info(f"Promoted prefetched download {download_id}")
+        return download_id
+
+    def _expire(self, key, download_id):
+        with self._lock:
+            if self._pending.get(key) != download_id:
+                return
+            del self._pending[key]
+        if not jobs.cancel(download_id, reason='prefetched download was not claimed'):
+            # Already finished: drop its files and progress entry
+            self.discard(download_id)
@@ -0,0 +1,133 @@
+"""
+On-demand profiling of a live process
+A time-boxed statistical sampler walks the stacks of every thread (request
+handlers, download threads, progress hooks) a few hundred times a second and
+returns them as folded stacks, ready for flamegraph.pl or speedscope, plus the
+hottest functions. Optionally tracemalloc runs for the same window and the top
+allocation sites are reported. Nothing is installed or traced outside a
+profiling window, so the endpoint costs nothing when not in use.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Upper bound for one profiling window
+MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+
+DEFAULT_INTERVAL = 0.005
+
+_busy = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is already running in this process"""
+
+
+def _frame_name(code, prefixes):
+    path = code.co_filename
+    for prefix in prefixes:
+        if path.startswith(prefix):
+            path = os.path.relpath(path, prefix)
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _stack(frame, names, prefixes):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        name = names.get(code)
+        if name is None:
+            name = names[code] = _frame_name(code, prefixes)
+        stack.append(name)
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def sample(seconds, interval=DEFAULT_INTERVAL):
+    """Sample all other threads' stacks; returns (Counter of folded stacks, sample rounds)"""
+    me = threading.get_ident()
+    # Longest sys.path entry first, so site-packages paths come out short
+    prefixes = sorted((p for p in sys.path if p), key=len, reverse=True)
+    frame_names = {}
+    stacks = Counter()
+    rounds = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stacks[';'.join([threads.get(ident, str(ident))] + _stack(frame, frame_names, prefixes))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def top_functions(stacks, limit=25):
+    """Functions by samples on top of the stack (self) and anywhere in it (total)"""
+    own, total = Counter(), Counter()
+    for folded, count in stacks.items():
+        frames = folded.split(';')[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [{'function': name, 'self': count, 'total': total[name]} for name, count in own.most_common(limit)]
+
+
+def thread_samples(stacks):
+    """Samples per thread name"""
+    counts = Counter()
+    for folded, count in stacks.items():
+        counts[folded.split(';', 1)[0]] += count
+    return dict(counts)
+
+
+def top_allocations(snapshot, limit=25):
+    """Largest live allocations, grouped by call stack"""
+    stats = snapshot.statistics('traceback')[:limit]
+    return [{
+        'size': stat.size,
+        'count': stat.count,
+        # Allocation site first, then its callers
+        'traceback': [f"{frame.filename}:{frame.lineno}" for frame in reversed(stat.traceback)],
+    } for stat in stats]
+
+
+def profile(seconds, interval=DEFAULT_INTERVAL, memory=False, frames=10):
+    """Run one profiling window in the calling thread and return the report"""
+    seconds = min(max(seconds, 0.1), MAX_SECONDS)
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    started_tracing = False
+    try:
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            started_tracing = True
+        started = time.monotonic()
+        stacks, rounds = sample(seconds, interval)
+        report = {
+            'seconds': round(time.monotonic() - started, 3),
+            'interval': interval,
+            'samples': rounds,
+            'threads': thread_samples(stacks),
+            'top_functions': top_functions(stacks),
+            'folded': '\n'.join(f"{folded} {count}" for folded, count in stacks.most_common()),
+        }
+        if memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            report['allocations'] = top_allocations(snapshot)
+            report['traced_memory'] = dict(zip(('current', 'peak'), tracemalloc.get_traced_memory()))
+        return report
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _busy.release()
@@ -0,0 +1,142 @@
+"""
+Progress reporting for download jobs
+One reporter per download turns whatever the transfer path knows (exact or
+estimated byte totals, HLS/DASH fragment counts, item counts of a carousel)
+into a monotonic percentage plus bytes, speed and ETA, and writes it to the
+job's progress entry at most every PROGRESS_INTERVAL seconds (default 0.25),
+so per-chunk callbacks cost a clock read instead of a dict update.
+"""
+
+import os
+import threading
+import time
+
+from utils.jobs import download_progress
+
+INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 0.25))
+
+
+class ProgressReporter:
+    def __init__(self, download_id, start=10, end=90, interval=None):
+        self.download_id = download_id
+        self.start = start
+        self.end = end
+        self.interval = INTERVAL if interval is None else interval
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self._progress = start
+        # Direct transfers: bytes so far, known lengths and the last speed sample
+        self._bytes = 0
+        self._lengths = []
+        self._items = (0, None)
+        self._speed_mark = None
+        # yt-dlp: files finished of a multi-format (video+audio) download
+        self._parts_done = 0
+
+    def _write(self, fields, force=False):
+        if self.download_id is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        state = download_progress.get(self.download_id)
+        if state is None:
+            return
+        if state.get('status') == 'cancelling':
+            fields.pop('status', None)
+        state.update(fields)
+
+    def _scale(self, fraction):
+        """Percentage for a fraction of the transfer; never moves backwards"""
+        fraction = min(max(fraction, 0.0), 1.0)
+        self._progress = max(self._progress, self.start + (self.end - self.start) * fraction)
+        return round(self._progress, 1)
+
+    def report(self, downloaded=None, total=None, estimated=False, fraction=None, speed=None,
+               eta=None, fragment_index=None, fragment_count=None, force=False):
+        """Record the transfer state; written at most once per interval"""
+        if not force and time.monotonic() - self._last_write < self.interval:
+            return
+        if fraction is None and downloaded is not None and total:
+            fraction = downloaded / total
+        if fraction is None and fragment_count:
+            fraction = (fragment_index or 0) / fragment_count
+        fields = {'status': 'downloading'}
+        if fraction is not None:
+            fields['progress'] = self._scale(fraction)
+        for key, value in (('downloaded_bytes', downloaded), ('total_bytes', total), ('speed', speed),
+                           ('eta', eta), ('fragment_index', fragment_index),
+                           ('fragment_count', fragment_count)):
+            if value is not None:
+                fields[key] = round(value) if isinstance(value, float) else value
+        if total:
+            fields['total_is_estimate'] = estimated
+        self._write(fields, force)
+
+    def finish(self, status='processing'):
+        """Transfer done, e.g. post-processing starts"""
+        self._write({'status': status, 'progress': self._scale(1.0), 'eta': 0}, force=True)
+
+    def ydl_hook(self):
+        """yt-dlp progress hook"""
+        def hook(d):
+            parts = len((d.get('info_dict') or {}).get('requested_formats') or ()) or 1
+            if d['status'] == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded = d.get('downloaded_bytes')
+                fraction = None
+                if total and downloaded is not None:
+                    fraction = downloaded / total
+                elif d.get('fragment_count'):
+                    fraction = (d.get('fragment_index') or 0) / d['fragment_count']
+                if fraction is not None:
+                    fraction = (self._parts_done + min(fraction, 1.0)) / parts
+                self.report(downloaded, total, estimated=not d.get('total_bytes'), fraction=fraction,
+                            speed=d.get('speed'), eta=d.get('eta'), fragment_index=d.get('fragment_index'),
+                            fragment_count=d.get('fragment_count'))
+            elif d['status'] == 'finished':
+                self._parts_done += 1
+                if self._parts_done >= parts:
+                    self.finish()
+                else:
+                    self.report(fraction=self._parts_done / parts, force=True)
+        return hook
+
+    def add_length(self, length):
+        """Content-Length of one of the items being fetched"""
+        with self._lock:
+            self._lengths.append(length)
+
+    def add_bytes(self, count):
+        """Bytes received by a direct (requests) transfer; thread-safe"""
+        with self._lock:
+            self._bytes += count
+            now = time.monotonic()
+            if self._speed_mark is None:
+                self._speed_mark = (now, 0)
+            if now - self._last_write < self.interval:
+                return
+            mark_time, mark_bytes = self._speed_mark
+            speed = (self._bytes - mark_bytes) / (now - mark_time) if now > mark_time else None
+            self._speed_mark = (now, self._bytes)
+            done, count_total = self._items
+            # Byte totals are only meaningful once every item's length is known
+            total = sum(self._lengths) if count_total and len(self._lengths) == count_total else None
+            fraction = None if total else (done / count_total if count_total else None)
+            eta = (total - self._bytes) / speed if total and speed else None
+            self.report(self._bytes, total, fraction=fraction, speed=speed, eta=eta)
+
+    def expect_items(self, count):
+        with self._lock:
+            self._items = (0, count)
+
+    def item_done(self, done, count):
+        with self._lock:
+            self._items = (done, count)
+        self.report(self._bytes, fraction=done / count if count else None, force=done == count)
+
+
+def ydl_hook(download_id, start=10, end=90):
+    """yt-dlp progress hook of a fresh reporter for the job"""
+    return ProgressReporter(download_id, start, end).ydl_hook()
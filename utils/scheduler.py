@@ -0,0 +1,295 @@
+"""
+Per-client fair-share scheduling and quotas
+Downloads run in CONCURRENT_DOWNLOADS slots. Each job is tagged with the
+client that submitted it (its X-API-Key if listed in API_KEYS, else its IP
+address) and waiting jobs are dispatched with weighted fair queuing across
+clients, so one client submitting hundreds of URLs gets its share of the
+slots without delaying everyone else's jobs behind its backlog. Workers claiming from a work queue
+apply the same weights and limit across all of them (see least_served).
+
+Configuration (environment):
+    CONCURRENT_DOWNLOADS    download slots (default 5)
+    CLIENT_MAX_CONCURRENT   slots one client may hold at once (default 3, 0 = no limit)
+    CLIENT_WEIGHTS          relative shares, e.g. "bulk-key=0.5,partner-key=4" (default 1)
+    CLIENT_DAILY_QUOTA      bytes a client may download per UTC day, e.g. 20GB
+    API_KEYS                comma-separated X-API-Key values that identify a client
+    USAGE_DB                SQLite file daily usage is kept in (default data/usage.db;
+                            Redis is used instead with a redis:// WORK_QUEUE)
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from downloaders.format_policy import parse_size
+
+logger = logging.getLogger(__name__)
+
+# X-API-Key values clients may identify themselves with
+API_KEYS = frozenset(key.strip() for key in os.environ.get('API_KEYS', '').split(',') if key.strip())
+
+
+def parse_weights(value):
+    """{client: weight} from "a=2,b=0.5" """
+    weights = {}
+    for part in (value or '').split(','):
+        if '=' in part:
+            client, weight = part.rsplit('=', 1)
+            weights[client.strip()] = float(weight)
+    return weights
+
+
+# Slots one client may hold at once and relative shares, see the module docstring
+CLIENT_MAX_CONCURRENT = int(os.environ.get('CLIENT_MAX_CONCURRENT', 3))
+CLIENT_WEIGHTS = parse_weights(os.environ.get('CLIENT_WEIGHTS'))
+
+
+def least_served(queued, running, client_limit=0, weights=None):
+    """Client whose oldest waiting job should be claimed next, or None
+
+    queued maps each client with waiting jobs to when its oldest one was
+    queued, running maps clients to their running jobs. The client with the
+    fewest running jobs per unit of weight goes first, the oldest job breaking
+    ties; clients at client_limit wait.
+    """
+    weights = weights or {}
+    candidates = [(running.get(client, 0) / weights.get(client, 1.0), created, client)
+                  for client, created in queued.items()
+                  if not client_limit or running.get(client, 0) < client_limit]
+    return min(candidates, key=lambda c: c[:2])[2] if candidates else None
+
+
+def client_id(request):
+    """Identity a Flask request is scheduled and billed under: a known API key, else its IP"""
+    key = request.headers.get('X-API-Key')
+    # Unknown keys are ignored, or a fresh key would mean a fresh quota and share
+    return key if key and key in API_KEYS else request.remote_addr
+
+
+class FairScheduler:
+    def __init__(self, slots=5, client_limit=3, weights=None):
+        self.slots = slots
+        self.client_limit = client_limit
+        self.weights = weights or {}
+        self._queues = {}
+        self._finish_tags = {}
+        self._running = {}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(slots=int(os.environ.get('CONCURRENT_DOWNLOADS', 5)),
+                   client_limit=CLIENT_MAX_CONCURRENT, weights=CLIENT_WEIGHTS)
+
+    def weight(self, client):
+        return self.weights.get(client, 1.0)
+
+    def submit(self, client, job_id, run):
+        """Queue run() for client; it starts in its own thread when scheduled"""
+        with self._lock:
+            # Each job costs 1/weight of virtual time, so a client's jobs are
+            # spaced out by its share whatever the size of its backlog
+            start_tag = max(self._virtual_time, self._finish_tags.get(client, 0.0))
+            self._finish_tags[client] = start_tag + 1.0 / self.weight(client)
+            self._queues.setdefault(client, deque()).append((self._finish_tags[client], job_id, run))
+        self._dispatch()
+
+    def retag(self, job_id, client):
+        """Move a still queued job to client's queue, with a new place in its share"""
+        with self._lock:
+            for owner, queue in self._queues.items():
+                entry = next((e for e in queue if e[1] == job_id), None)
+                if entry is None:
+                    continue
+                if owner == client:
+                    return True
+                queue.remove(entry)
+                if not queue:
+                    del self._queues[owner]
+                start_tag = max(self._virtual_time, self._finish_tags.get(client, 0.0))
+                self._finish_tags[client] = start_tag + 1.0 / self.weight(client)
+                self._queues.setdefault(client, deque()).append((self._finish_tags[client], job_id, entry[2]))
+                break
+            else:
+                return False
+        self._dispatch()
+        return True
+
+    def _next(self):
+        """Waiting job with the smallest finish tag among clients under their limit"""
+        best = None
+        for client, queue in self._queues.items():
+            if not queue:
+                continue
+            if self.client_limit and self._running.get(client, 0) >= self.client_limit:
+                continue
+            if best is None or queue[0][0] < self._queues[best][0][0]:
+                best = client
+        return best
+
+    def _dispatch(self):
+        with self._lock:
+            while sum(self._running.values()) < self.slots:
+                client = self._next()
+                if client is None:
+                    break
+                tag, job_id, run = self._queues[client].popleft()
+                if not self._queues[client]:
+                    del self._queues[client]
+                self._virtual_time = max(self._virtual_time, tag)
+                self._running[client] = self._running.get(client, 0) + 1
+                thread = threading.Thread(target=self._run, args=(client, run), name=f'download-{job_id[:8]}')
+                thread.daemon = True
+                thread.start()
+
+    def _run(self, client, run):
+        try:
+            run()
+        except Exception as e:
+            logger.error(f"Scheduled job failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._running[client] -= 1
+                if not self._running[client]:
+                    del self._running[client]
+                    if client not in self._queues:
+                        self._finish_tags.pop(client, None)
+            self._dispatch()
+
+    def client_state(self, client):
+        with self._lock:
+            return {
+                'running': self._running.get(client, 0),
+                'queued': len(self._queues.get(client, ())),
+                'weight': self.weight(client),
+                'concurrency_limit': self.client_limit or self.slots,
+            }
+
+
+class UsageTracker:
+    """Jobs and bytes downloaded per client and UTC day, in process memory"""
+
+    def __init__(self, daily_quota=None):
+        self.daily_quota = daily_quota
+        self._day = None
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _today():
+        return time.strftime('%Y-%m-%d', time.gmtime())
+
+    def record(self, client, size):
+        with self._lock:
+            day = self._today()
+            if day != self._day:
+                # Earlier days are of no further use
+                self._day, self._usage = day, {}
+            usage = self._usage.setdefault(client, {'jobs': 0, 'bytes': 0})
+            usage['jobs'] += 1
+            usage['bytes'] += size or 0
+
+    def get(self, client):
+        with self._lock:
+            day = self._today()
+            usage = self._usage.get(client) if day == self._day else None
+            return {'day': day, **(usage or {'jobs': 0, 'bytes': 0})}
+
+    def over_quota(self, client):
+        return bool(self.daily_quota) and self.get(client)['bytes'] >= self.daily_quota
+
+
+class SQLiteUsage(UsageTracker):
+    """Usage in a SQLite file shared by the web and worker processes of a host"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS usage (
+            client TEXT NOT NULL,
+            day TEXT NOT NULL,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (client, day)
+        );
+    """
+
+    def __init__(self, path, daily_quota=None):
+        super().__init__(daily_quota)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._db().executescript(self.SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def record(self, client, size):
+        day = self._today()
+        db = self._db()
+        db.execute("INSERT INTO usage (client, day, jobs, bytes) VALUES (?, ?, 1, ?) "
+                   "ON CONFLICT (client, day) DO UPDATE SET jobs = jobs + 1, bytes = bytes + excluded.bytes",
+                   (client, day, size or 0))
+        if day != self._day:
+            self._day = day
+            db.execute("DELETE FROM usage WHERE day < ?", (day,))
+
+    def get(self, client):
+        day = self._today()
+        row = self._db().execute("SELECT jobs, bytes FROM usage WHERE client = ? AND day = ?",
+                                 (client, day)).fetchone()
+        return {'day': day, 'jobs': row[0] if row else 0, 'bytes': row[1] if row else 0}
+
+
+class RedisUsage(UsageTracker):
+    """Usage in Redis, for web nodes and workers on several hosts"""
+
+    # Each day's counters outlive the day by this long
+    TTL = 2 * 24 * 3600
+
+    def __init__(self, redis, prefix='smd', daily_quota=None):
+        super().__init__(daily_quota)
+        self.redis = redis
+        self.prefix = prefix
+
+    def _key(self, client, day):
+        return f'{self.prefix}:usage:{day}:{client}'
+
+    def record(self, client, size):
+        key = self._key(client, self._today())
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, 'jobs', 1)
+        pipe.hincrby(key, 'bytes', size or 0)
+        pipe.expire(key, self.TTL)
+        pipe.execute()
+
+    def get(self, client):
+        day = self._today()
+        jobs, size = self.redis.hmget(self._key(client, day), 'jobs', 'bytes')
+        return {'day': day, 'jobs': int(jobs or 0), 'bytes': int(size or 0)}
+
+
+def usage_from_env(queue=None):
+    """Usage tracker shared with the other processes: Redis with a Redis work queue, else USAGE_DB"""
+    quota = parse_size(os.environ.get('CLIENT_DAILY_QUOTA'))
+    if getattr(queue, 'redis', None) is not None:
+        return RedisUsage(queue.redis, queue.prefix, quota)
+    path = os.environ.get('USAGE_DB', os.path.join('data', 'usage.db'))
+    return SQLiteUsage(path, quota) if path else UsageTracker(quota)
+
+
+def result_size(result):
+    """Bytes a finished download produced"""
+    items = result.get('items') or result.get('all_files')
+    if items:
+        return sum(item.get('size') or 0 for item in items)
+    return result.get('file_size') or 0
@@ -0,0 +1,278 @@
+"""
+Persistent extractor sessions
+Keeps yt-dlp cookie jars and instaloader sessions on disk so every download
+(and every worker sharing the directory) reuses the cookies an earlier one
+bootstrapped or logged in with, instead of starting anonymous each time.
+
+Layout of SESSIONS_DIR (default data/sessions):
+    <platform>/*.txt              yt-dlp cookie jars (Netscape format). Export
+                                  an account's browser cookies here to use it;
+                                  without any, anonymous.txt is kept.
+    instagram/session-<username>  instaloader session files, e.g. from
+                                  instaloader --login <user> --sessionfile ...
+
+Each platform's jars form a pool: downloads take the least recently used jar
+that is not cooling down, work on a private copy and write the refreshed
+cookies back atomically. A jar or session that hits throttling or a login wall
+is rested for SESSION_COOLDOWN seconds (default 900) and the next one is used.
+Jars whose cookies expire within SESSION_REFRESH_MARGIN seconds (default one
+day) are used first so their sessions get renewed before they lapse, and
+instaloader sessions older than SESSION_MAX_AGE seconds (default one day) are
+re-validated, logging in again with INSTAGRAM_USERNAME/INSTAGRAM_PASSWORD if
+they are no longer valid. One Instaloader per process (instagram()) serves
+both downloads and subscription polls; its session is loaded on first use.
+"""
+
+import contextlib
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_DIR = os.environ.get('SESSIONS_DIR', os.path.join('data', 'sessions'))
+COOLDOWN = float(os.environ.get('SESSION_COOLDOWN', 900))
+REFRESH_MARGIN = float(os.environ.get('SESSION_REFRESH_MARGIN', 24 * 3600))
+MAX_AGE = float(os.environ.get('SESSION_MAX_AGE', 24 * 3600))
+
+# How often an in-use instaloader session is written back to disk
+SAVE_INTERVAL = 600
+
+THROTTLE_MARKERS = ('429', 'too many requests', 'rate-limit', 'rate limit', 'please wait a few minutes',
+                    'login required', 'sign in to confirm')
+
+
+def is_throttled(exc):
+    """Whether an extractor error means this session is being throttled or walled"""
+    text = str(exc).lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+class CookiePool:
+    """yt-dlp cookie jars of one platform"""
+
+    def __init__(self, platform, root=None, cooldown=COOLDOWN, refresh_margin=REFRESH_MARGIN):
+        self.platform = platform
+        self.dir = os.path.join(root or SESSIONS_DIR, platform)
+        self.cooldown = cooldown
+        self.refresh_margin = refresh_margin
+        self._cooling = {}
+        self._last_used = {}
+        # path -> (mtime_ns, earliest cookie expiry) as of the last load or save
+        self._expiries = {}
+        self._lock = threading.Lock()
+
+    def jars(self):
+        os.makedirs(self.dir, exist_ok=True)
+        return sorted(glob.glob(os.path.join(self.dir, '*.txt'))) or [os.path.join(self.dir, 'anonymous.txt')]
+
+    def _remember_expiry(self, path, jar):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        self._expiries[path] = (mtime, min((c.expires for c in jar if c.expires), default=None))
+
+    def _expiry(self, path):
+        """Earliest cookie expiry of a jar; read again only if the file changed since"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._expiries.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        jar = YoutubeDLCookieJar(path)
+        try:
+            jar.load()
+        except Exception:
+            return None
+        self._remember_expiry(path, jar)
+        return self._expiries.get(path, (None, None))[1]
+
+    def pick(self):
+        """Jar to use next: not cooling down, expiring soonest first, else least recently used"""
+        now = time.time()
+        jars = self.jars()
+        expiries = {path: self._expiry(path) for path in jars}
+        with self._lock:
+            ready = [path for path in jars if self._cooling.get(path, 0) <= now]
+            if not ready:
+                ready = [min(jars, key=lambda path: self._cooling[path])]
+            path = min(ready, key=lambda p: (
+                not (expiries[p] is not None and expiries[p] - now < self.refresh_margin),
+                self._last_used.get(p, 0)))
+            self._last_used[path] = now
+        return path
+
+    def cool_down(self, path):
+        with self._lock:
+            self._cooling[path] = time.time() + self.cooldown
+        logger.warning(f"{self.platform} cookies {os.path.basename(path)} throttled, resting for {self.cooldown:.0f}s")
+
+    @contextlib.contextmanager
+    def lease(self, ydl_opts):
+        """Point ydl_opts at a private copy of a pooled jar, keep its cookies afterwards"""
+        path = self.pick()
+        copy = os.path.join(self.dir, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp")
+        if os.path.exists(path):
+            jar = YoutubeDLCookieJar(path)
+            try:
+                jar.load()
+                # Expired cookies are left out so the extractor negotiates fresh ones
+                jar.save(copy, ignore_expires=False)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable cookie jar {path}: {str(e)}")
+        ydl_opts['cookiefile'] = copy
+        try:
+            yield copy
+        except Exception as e:
+            if is_throttled(e):
+                self.cool_down(path)
+            raise
+        finally:
+            # yt-dlp has written the jar back on close, even after a failure
+            if os.path.exists(copy):
+                jar = YoutubeDLCookieJar(copy)
+                try:
+                    jar.load()
+                except Exception:
+                    jar = None
+                os.replace(copy, path)
+                if jar is not None:
+                    self._remember_expiry(path, jar)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def cookie_jar(platform, ydl_opts):
+    """Lease a cookie jar of platform's pool into ydl_opts for one YoutubeDL"""
+    with _pools_lock:
+        pool = _pools.get(platform)
+        if pool is None:
+            pool = _pools[platform] = CookiePool(platform)
+    return pool.lease(ydl_opts)
+
+
+class InstagramSessions:
+    """Rotates an Instaloader between the session files in SESSIONS_DIR/instagram"""
+
+    def __init__(self, loader, root=None, cooldown=COOLDOWN, max_age=MAX_AGE):
+        self.loader = loader
+        self.dir = os.path.join(root or SESSIONS_DIR, 'instagram')
+        self.cooldown = cooldown
+        self.max_age = max_age
+        self.current = None
+        self._cooling = {}
+        self._last_save = 0.0
+        self._activated = False
+        self._lock = threading.Lock()
+        self._ready_lock = threading.Lock()
+
+    def _path(self, username):
+        return os.path.join(self.dir, f'session-{username}')
+
+    def usernames(self):
+        os.makedirs(self.dir, exist_ok=True)
+        names = sorted(os.path.basename(p)[len('session-'):] for p in glob.glob(os.path.join(self.dir, 'session-*')))
+        # Workers start at different accounts so they do not all share one
+        offset = os.getpid() % len(names) if names else 0
+        return names[offset:] + names[:offset]
+
+    def _login(self, username):
+        """Log in again with the configured credentials; True on success"""
+        if username != os.environ.get('INSTAGRAM_USERNAME') or not os.environ.get('INSTAGRAM_PASSWORD'):
+            return False
+        try:
+            self.loader.login(username, os.environ['INSTAGRAM_PASSWORD'])
+            self.loader.save_session_to_file(self._path(username))
+            logger.info(f"Logged in to Instagram again as {username}")
+            return True
+        except Exception as e:
+            logger.warning(f"Instagram login as {username} failed: {str(e)}")
+            return False
+
+    def activate(self):
+        """Load the next usable session; stays anonymous if there is none"""
+        with self._lock:
+            now = time.time()
+            usernames = self.usernames()
+            if not usernames and os.environ.get('INSTAGRAM_USERNAME') and self._login(os.environ['INSTAGRAM_USERNAME']):
+                self.current = os.environ['INSTAGRAM_USERNAME']
+                return self.current
+            for username in usernames:
+                if self._cooling.get(username, 0) > now:
+                    continue
+                path = self._path(username)
+                try:
+                    self.loader.load_session_from_file(username, path)
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable Instagram session {username}: {str(e)}")
+                    continue
+                # Old sessions are checked before use and renewed if they lapsed
+                if now - os.path.getmtime(path) > self.max_age:
+                    if self.loader.test_login() != username and not self._login(username):
+                        logger.warning(f"Instagram session {username} has expired")
+                        self._cooling[username] = now + self.max_age
+                        continue
+                    os.utime(path)
+                self.current = username
+                return username
+            return self.current
+
+    def ready(self):
+        """The loader, with a session activated on first use (which may log in)"""
+        if not self._activated:
+            with self._ready_lock:
+                if not self._activated:
+                    self.activate()
+                    self._activated = True
+        return self.loader
+
+    def used(self):
+        """Persist cookies the current session picked up, at most every SAVE_INTERVAL"""
+        if self.current is None or time.time() - self._last_save < SAVE_INTERVAL:
+            return
+        self._last_save = time.time()
+        try:
+            self.loader.save_session_to_file(self._path(self.current))
+        except Exception as e:
+            logger.warning(f"Saving Instagram session {self.current} failed: {str(e)}")
+
+    def failed(self, exc):
+        """Rest a throttled session and switch to the next one"""
+        if self.current is None or not is_throttled(exc):
+            return
+        logger.warning(f"Instagram session {self.current} throttled, resting for {self.cooldown:.0f}s")
+        self._cooling[self.current] = time.time() + self.cooldown
+        self.activate()
+
+
+_instagram = None
+_instagram_lock = threading.Lock()
+
+
+def instagram():
+    """Process-wide InstagramSessions, shared by downloads and subscription polls"""
+    global _instagram
+    with _instagram_lock:
+        if _instagram is None:
+            import instaloader
+            loader = instaloader.Instaloader(
+                quiet=True,
+                download_videos=True,
+                download_video_thumbnails=False,
+                download_geotags=False,
+                download_comments=False,
+                save_metadata=False,
+                compress_json=False
+            )
+            _instagram = InstagramSessions(loader)
+    return _instagram
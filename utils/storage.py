@@ -0,0 +1,260 @@
+"""
+Storage for finished downloads
+Downloaders always write into the local downloads/ directory. When a job
+completes its files are committed to the configured backend, and
+/api/download_file serves them from there, so any web node can hand out a file
+that another node or worker produced.
+
+Backends, chosen with STORAGE_URL:
+    (unset) or local             files stay in downloads/ on the node that made them
+    s3://bucket/prefix           S3-compatible object storage (needs boto3);
+                                 S3_ENDPOINT_URL points it at MinIO & co.
+
+With S3 the node keeps a size-bounded LRU cache of recently produced and
+recently requested files, and /api/download_file answers with a redirect to a
+presigned URL so the bytes never pass through Python.
+
+Configuration (environment):
+    STORAGE_CACHE_DIR    local cache of the S3 backend (default downloads/.cache)
+    STORAGE_CACHE_SIZE   cache size, e.g. 2GB (default)
+    STORAGE_PART_SIZE    multipart upload/download part size (default 16MB)
+    STORAGE_URL_TTL      lifetime of presigned URLs in seconds (default 3600)
+    STORAGE_REDIRECT     false to serve S3 files through the cache instead
+"""
+
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import unicodedata
+import uuid
+from collections import OrderedDict
+from urllib.parse import quote, urlparse
+
+from downloaders.format_policy import parse_size
+from utils import integrity, metrics
+
+logger = logging.getLogger(__name__)
+
+# Serve remote files with a redirect to a presigned URL
+REDIRECT = os.environ.get('STORAGE_REDIRECT', 'True').lower() == 'true'
+
+
+class LocalStorage:
+    """Files stay where the downloader wrote them; the key is the path"""
+
+    def put(self, path, key):
+        return path
+
+    def local_path(self, key):
+        # A committed file that no longer matches its manifest record is not served
+        return key if os.path.exists(key) and integrity.intact(key) is not False else None
+
+    def fetch(self, key):
+        return self.local_path(key)
+
+    def url(self, key, filename):
+        return None
+
+    def delete(self, key):
+        if os.path.exists(key):
+            os.remove(key)
+
+
+class HotCache:
+    """Local copies of stored files, evicting the least recently used"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Pick up files cached before a restart, oldest first"""
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if '.tmp-' in name:
+                    os.remove(path)
+                    continue
+                found.append((os.path.getmtime(path), os.path.relpath(path, self.root), os.path.getsize(path)))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Cached path of a key, or None"""
+        with self._lock:
+            hit = key in self._entries and os.path.exists(self.path(key))
+            if hit:
+                self._entries.move_to_end(key)
+        metrics.record_cache('storage', hit)
+        return self.path(key) if hit else None
+
+    def adopt(self, key, src):
+        """Move a freshly produced file into the cache"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(src, path)
+        self._add(key, path)
+        return path
+
+    def fill(self, key, write):
+        """Cache a key by letting write(tmp_path) produce it"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._add(key, path)
+        return path
+
+    def discard(self, key):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def _add(self, key, path):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = os.path.getsize(path)
+            self._size += self._entries[key]
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                # The newest entry stays even if it alone is over the limit
+                if self._size <= self.max_bytes or len(self._entries) <= 1:
+                    return
+                key, size = self._entries.popitem(last=False)
+                self._size -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+
+class S3Storage:
+    """S3-compatible object storage with a local hot cache"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, cache=None,
+                 part_size=16 * 1024 ** 2, url_ttl=3600):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise Exception("STORAGE_URL is an s3:// URL but the boto3 package is not installed")
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.cache = cache
+        self.url_ttl = url_ttl
+        # Files over one part are uploaded/downloaded in parallel parts straight from/to disk
+        self.transfer = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size)
+
+    def _object(self, key):
+        return self.prefix + key
+
+    def put(self, path, key):
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.client.upload_file(path, self.bucket, self._object(key), Config=self.transfer,
+                                ExtraArgs={'ContentType': content_type})
+        # Just produced here, so likely to be requested from this node next
+        self.cache.adopt(key, path)
+        return key
+
+    def local_path(self, key):
+        return self.cache.get(key)
+
+    def fetch(self, key):
+        """Local path of a key, downloading it into the cache on a miss"""
+        path = self.cache.get(key)
+        if path:
+            return path
+        from botocore.exceptions import ClientError
+        try:
+            return self.cache.fill(key, lambda tmp_path: self.client.download_file(
+                self.bucket, self._object(key), tmp_path, Config=self.transfer))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    def url(self, key, filename):
+        return self.client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': self._object(key),
+            'ResponseContentDisposition': content_disposition(filename),
+        }, ExpiresIn=self.url_ttl)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        self.cache.discard(key)
+
+
+def content_disposition(filename):
+    """attachment header for any file name: ASCII fallback plus RFC 5987 UTF-8 name"""
+    stem, ext = os.path.splitext(filename)
+    stem = unicodedata.normalize('NFKD', stem).encode('ascii', 'ignore').decode('ascii')
+    stem = re.sub(r'[^\w.()\[\] -]', '_', stem, flags=re.ASCII).strip(' ._') or 'download'
+    fallback = stem + re.sub(r'[^\w.]', '_', ext, flags=re.ASCII)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def create_storage(url):
+    """Build a storage backend from a STORAGE_URL"""
+    if not url or url == 'local':
+        return LocalStorage()
+    parts = urlparse(url)
+    if parts.scheme == 's3':
+        cache = HotCache(os.environ.get('STORAGE_CACHE_DIR', os.path.join('downloads', '.cache')),
+                         parse_size(os.environ.get('STORAGE_CACHE_SIZE', '2GB')))
+        return S3Storage(parts.netloc, parts.path,
+                         endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+                         cache=cache,
+                         part_size=parse_size(os.environ.get('STORAGE_PART_SIZE', '16MB')),
+                         url_ttl=int(os.environ.get('STORAGE_URL_TTL', 3600)))
+    raise ValueError(f"Unsupported STORAGE_URL: {url}")
+
+
+def from_env():
+    return create_storage(os.environ.get('STORAGE_URL'))
+
+
+def commit_result(storage, download_id, result):
+    """Store every file of a download result and record its storage_key"""
+    keys = {}
+    for entry in (result.get('items') or []) + (result.get('all_files') or []) + [result]:
+        path = entry.get('path') or entry.get('file_path')
+        if not path:
+            continue
+        if path not in keys:
+            keys[path] = storage.put(path, f"{download_id}/{os.path.basename(path)}")
+        entry['storage_key'] = keys[path]
+    return result
+
+
+def result_files(result):
+    """(storage_key, filename) of every item of a result, main file alone if single"""
+    entries = result.get('items') or result.get('all_files') or [result]
+    files = []
+    for entry in entries:
+        path = entry.get('path') or entry.get('file_path')
+        files.append((entry.get('storage_key') or path, entry.get('filename') or os.path.basename(path)))
+    return files
@@ -0,0 +1,450 @@
+"""
+Subscriptions: watch channels and accounts and download only new items
+Each registered source (a YouTube channel, TikTok or Instagram account, ...)
+is polled on its own interval with jitter. A persistent per-source archive of
+seen media ids means only new items are enqueued, and listings stop as soon
+as they reach already seen items, so a poll costs roughly one listing page
+however large the catalogue is.
+
+- YouTube /channel/UC... sources are polled through the channel's RSS feed
+  with If-None-Match/If-Modified-Since, so an unchanged channel costs a 304.
+- Other yt-dlp sources use a lazy flat listing (no per-item extraction).
+- Instagram profiles walk instaloader's newest-first post iterator.
+
+Submitted items stay pending until their download completes; one that fails
+or is cancelled is unmarked and picked up again by a later poll, up to
+SUBSCRIPTION_MAX_ATTEMPTS (default 3) times.
+
+Per-platform budgets (polls per hour, SUBSCRIPTION_BUDGETS, e.g.
+"youtube=240,tiktok=60") defer polls rather than hammering one platform.
+"""
+
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+import yt_dlp
+
+from utils import metrics, sessions
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get('SUBSCRIPTIONS_DB', os.path.join('data', 'subscriptions.db'))
+
+# Entries read per listing at most, and new items enqueued per poll at most
+LISTING_WINDOW = int(os.environ.get('SUBSCRIPTION_WINDOW', 50))
+MAX_NEW_PER_POLL = int(os.environ.get('SUBSCRIPTION_MAX_NEW', 20))
+
+# Consecutive already seen entries after which a listing stops
+STOP_AFTER_SEEN = 3
+
+# Downloads of one item tried at most before it is left as seen
+MAX_ATTEMPTS = int(os.environ.get('SUBSCRIPTION_MAX_ATTEMPTS', 3))
+
+# Client subscription downloads are scheduled and billed under; nobody polls
+# their progress, so they are exempt from idle cancellation
+CLIENT = 'subscriptions'
+
+DEFAULT_INTERVAL = 3600
+JITTER = 0.1
+
+# Polls per hour and platform unless SUBSCRIPTION_BUDGETS says otherwise
+DEFAULT_BUDGETS = {'youtube': 240, 'tiktok': 60, 'instagram': 30, 'twitter': 30, 'facebook': 30}
+
+YOUTUBE_CHANNEL_PATTERN = re.compile(r'youtube\.com/channel/(UC[\w-]{22})')
+YOUTUBE_FEED_URL = 'https://www.youtube.com/feeds/videos.xml?channel_id={}'
+YOUTUBE_FEED_ID_PATTERN = re.compile(r'<yt:videoId>([\w-]{11})</yt:videoId>')
+
+
+class SubscriptionStore:
+    """Sources and their seen-id archives in SQLite"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL UNIQUE,
+            platform TEXT NOT NULL,
+            format TEXT NOT NULL DEFAULT 'best',
+            interval REAL NOT NULL,
+            backfill INTEGER NOT NULL DEFAULT 0,
+            etag TEXT,
+            last_modified TEXT,
+            last_polled REAL,
+            next_poll REAL NOT NULL,
+            last_error TEXT,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS seen (
+            source_id INTEGER NOT NULL,
+            media_id TEXT NOT NULL,
+            first_seen REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'done',
+            download_id TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (source_id, media_id)
+        ) WITHOUT ROWID;
+    """
+
+    # Columns added to seen since it was first created
+    SEEN_COLUMNS = {
+        'status': "TEXT NOT NULL DEFAULT 'done'",
+        'download_id': 'TEXT',
+        'attempts': 'INTEGER NOT NULL DEFAULT 0',
+    }
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(self.SCHEMA)
+        existing = {row['name'] for row in db.execute("PRAGMA table_info(seen)")}
+        for name, definition in self.SEEN_COLUMNS.items():
+            if name not in existing:
+                try:
+                    db.execute(f"ALTER TABLE seen ADD COLUMN {name} {definition}")
+                except sqlite3.OperationalError:
+                    # Added by another process in the meantime
+                    pass
+        db.execute("CREATE INDEX IF NOT EXISTS seen_pending ON seen (status) WHERE status = 'pending'")
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def add(self, url, platform, format_type='best', interval=DEFAULT_INTERVAL, backfill=False):
+        now = time.time()
+        cursor = self._db().execute(
+            "INSERT INTO sources (url, platform, format, interval, backfill, next_poll, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, platform, format_type, interval, int(backfill), now, now))
+        return self.get(cursor.lastrowid)
+
+    def get(self, source_id):
+        row = self._db().execute("SELECT * FROM sources WHERE id = ?", (source_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self):
+        rows = self._db().execute(
+            "SELECT sources.*, (SELECT COUNT(*) FROM seen WHERE seen.source_id = sources.id "
+            "AND seen.status != 'failed') AS seen_count "
+            "FROM sources ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def remove(self, source_id):
+        db = self._db()
+        db.execute("DELETE FROM seen WHERE source_id = ?", (source_id,))
+        return db.execute("DELETE FROM sources WHERE id = ?", (source_id,)).rowcount > 0
+
+    def due(self, now=None):
+        rows = self._db().execute(
+            "SELECT * FROM sources WHERE next_poll <= ? ORDER BY next_poll", (now or time.time(),)).fetchall()
+        return [dict(row) for row in rows]
+
+    def reschedule(self, source_id, next_poll, **fields):
+        fields['next_poll'] = next_poll
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        self._db().execute(f"UPDATE sources SET {assignments} WHERE id = ?", (*fields.values(), source_id))
+
+    def is_seen(self, source_id, media_id):
+        """Whether an item is downloaded or being downloaded"""
+        return self._db().execute(
+            "SELECT 1 FROM seen WHERE source_id = ? AND media_id = ? AND status != 'failed'",
+            (source_id, media_id)).fetchone() is not None
+
+    def mark_seen(self, source_id, media_ids):
+        now = time.time()
+        self._db().executemany(
+            "INSERT INTO seen (source_id, media_id, first_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT (source_id, media_id) DO UPDATE SET status = 'done', download_id = NULL",
+            [(source_id, media_id, now) for media_id in media_ids])
+
+    def mark_submitted(self, source_id, media_id, download_id):
+        """Seen while download_id runs, see mark_seen and mark_failed"""
+        self._db().execute(
+            "INSERT INTO seen (source_id, media_id, first_seen, status, download_id, attempts) "
+            "VALUES (?, ?, ?, 'pending', ?, 1) "
+            "ON CONFLICT (source_id, media_id) DO UPDATE SET status = 'pending', "
+            "download_id = excluded.download_id, attempts = attempts + 1",
+            (source_id, media_id, time.time(), download_id))
+
+    def mark_failed(self, source_id, media_id):
+        """Unsee an item whose download failed so the next poll submits it again"""
+        db = self._db()
+        db.execute("UPDATE seen SET status = 'failed', download_id = NULL WHERE source_id = ? AND media_id = ?",
+                   (source_id, media_id))
+        # Or an unchanged feed would answer the next poll with a 304
+        db.execute("UPDATE sources SET etag = NULL, last_modified = NULL WHERE id = ?", (source_id,))
+
+    def submitted(self):
+        """Items whose downloads have not finished yet"""
+        rows = self._db().execute(
+            "SELECT source_id, media_id, download_id, attempts FROM seen WHERE status = 'pending'").fetchall()
+        return [dict(row) for row in rows]
+
+
+class PlatformBudget:
+    """Token bucket of polls per hour for each platform"""
+
+    def __init__(self, per_hour):
+        self.per_hour = per_hour
+        self._tokens = {platform: max(1.0, rate / 12) for platform, rate in per_hour.items()}
+        self._updated = {platform: time.monotonic() for platform in per_hour}
+        self._lock = threading.Lock()
+
+    def take(self, platform):
+        rate = self.per_hour.get(platform)
+        if rate is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            capacity = max(1.0, rate / 12)
+            tokens = min(capacity, self._tokens[platform] + (now - self._updated[platform]) * rate / 3600)
+            self._updated[platform] = now
+            if tokens < 1:
+                self._tokens[platform] = tokens
+                return False
+            self._tokens[platform] = tokens - 1
+            return True
+
+
+def parse_budgets(value):
+    budgets = dict(DEFAULT_BUDGETS)
+    for part in filter(None, (value or '').split(',')):
+        platform, _, rate = part.partition('=')
+        budgets[platform.strip()] = float(rate)
+    return budgets
+
+
+class Listing:
+    def __init__(self, entries=(), etag=None, last_modified=None, not_modified=False):
+        self.entries = list(entries)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+
+
+def _stop_early(entries, is_seen, window):
+    """Take entries until the window is full or several in a row were seen"""
+    taken = []
+    seen_run = 0
+    for entry in entries:
+        taken.append(entry)
+        seen_run = seen_run + 1 if is_seen(entry['id']) else 0
+        if seen_run >= STOP_AFTER_SEEN or len(taken) >= window:
+            break
+    return taken
+
+
+def list_youtube_feed(source, channel_id):
+    """Latest uploads of a channel via its RSS feed, conditionally"""
+    headers = {}
+    if source.get('etag'):
+        headers['If-None-Match'] = source['etag']
+    if source.get('last_modified'):
+        headers['If-Modified-Since'] = source['last_modified']
+    response = requests.get(YOUTUBE_FEED_URL.format(channel_id), headers=headers, timeout=30)
+    if response.status_code == 304:
+        return Listing(etag=source.get('etag'), last_modified=source.get('last_modified'), not_modified=True)
+    response.raise_for_status()
+    entries = [{'id': video_id, 'url': f'https://www.youtube.com/watch?v={video_id}'}
+               for video_id in YOUTUBE_FEED_ID_PATTERN.findall(response.text)]
+    return Listing(entries, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+def list_flat(source, is_seen, window=LISTING_WINDOW):
+    """Flat yt-dlp listing, read lazily so known items end the walk"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'playlistend': window,
+        'lazy_playlist': True,
+    }
+    with sessions.cookie_jar(source['platform'], ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(source['url'], download=False, process=False)
+        raw = info.get('entries') if info.get('_type') in ('playlist', 'multi_video') else [info]
+
+        def entries():
+            for entry in raw or []:
+                if not entry or not entry.get('id'):
+                    continue
+                url = entry.get('webpage_url') or entry.get('url')
+                if url and url.startswith(('http://', 'https://')):
+                    yield {'id': entry['id'], 'url': url}
+
+        return Listing(_stop_early(entries(), is_seen, window))
+
+
+def list_instagram(source, is_seen, window=LISTING_WINDOW):
+    """Newest posts of an Instagram profile, skipping pinned ones when stopping"""
+    import instaloader
+
+    username = urlparse(source['url']).path.strip('/').split('/')[0]
+    # Same logged-in sessions as the downloader, rotated on throttling
+    instagram = sessions.instagram()
+    taken = []
+    seen_run = 0
+    try:
+        profile = instaloader.Profile.from_username(instagram.ready().context, username)
+        for post in profile.get_posts():
+            taken.append({'id': post.shortcode, 'url': f'https://www.instagram.com/p/{post.shortcode}/'})
+            if not post.is_pinned:
+                seen_run = seen_run + 1 if is_seen(post.shortcode) else 0
+            if seen_run >= STOP_AFTER_SEEN or len(taken) >= window:
+                break
+    except Exception as e:
+        instagram.failed(e)
+        raise
+    instagram.used()
+    return Listing(taken)
+
+
+def list_source(source, is_seen):
+    """Newest entries of a source ({'id', 'url'}), newest first"""
+    if source['platform'] == 'youtube':
+        match = YOUTUBE_CHANNEL_PATTERN.search(source['url'])
+        if match:
+            return list_youtube_feed(source, match.group(1))
+    if source['platform'] == 'instagram':
+        return list_instagram(source, is_seen)
+    return list_flat(source, is_seen)
+
+
+class SubscriptionScheduler:
+    """Poll due sources and hand new items to submit(url, format_type)
+
+    submit returns the job's download id and job_state(download_id) its
+    progress snapshot; without job_state items are seen once submitted.
+    """
+
+    def __init__(self, store, submit, budgets=None, tick=5.0, job_state=None):
+        self.store = store
+        self.submit = submit
+        self.job_state = job_state
+        self.budget = PlatformBudget(budgets or parse_budgets(os.environ.get('SUBSCRIPTION_BUDGETS')))
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='subscriptions', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.settle()
+            except Exception as e:
+                logger.error(f"Checking subscription downloads failed: {str(e)}")
+            for source in self.store.due():
+                if self._stop.is_set():
+                    break
+                try:
+                    self.poll(source)
+                except Exception as e:
+                    logger.error(f"Polling {source['url']} failed: {str(e)}")
+            self._stop.wait(self.tick)
+
+    def _next_poll(self, interval):
+        return time.time() + interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def poll(self, source):
+        """Poll one source now; returns the number of items enqueued"""
+        platform = source['platform']
+        if not self.budget.take(platform):
+            # Out of budget for this platform, try again a bit later
+            metrics.SUBSCRIPTION_POLLS.inc(platform=platform, result='deferred')
+            self.store.reschedule(source['id'], self._next_poll(min(source['interval'], 300)))
+            return 0
+
+        try:
+            with metrics.time_stage(platform, 'poll'):
+                listing = list_source(source, lambda media_id: self.store.is_seen(source['id'], media_id))
+        except Exception as e:
+            metrics.SUBSCRIPTION_POLLS.inc(platform=platform, result='error')
+            logger.warning(f"Listing {source['url']} failed: {str(e)}")
+            self.store.reschedule(source['id'], self._next_poll(source['interval']), last_error=str(e)[:500])
+            return 0
+
+        now = time.time()
+        if listing.not_modified:
+            metrics.SUBSCRIPTION_POLLS.inc(platform=platform, result='not_modified')
+            self.store.reschedule(source['id'], self._next_poll(source['interval']), last_polled=now,
+                                  last_error=None)
+            return 0
+
+        new = [entry for entry in listing.entries if not self.store.is_seen(source['id'], entry['id'])]
+        if source['last_polled'] is None and not source['backfill']:
+            # First poll only records the existing catalogue
+            self.store.mark_seen(source['id'], [entry['id'] for entry in new])
+            new = []
+
+        # Oldest first, capped; the rest stays unseen for the next poll
+        submitted = []
+        for entry in reversed(new[-MAX_NEW_PER_POLL:]):
+            download_id = self.submit(entry['url'], source['format'])
+            submitted.append(entry['id'])
+            if self.job_state is None:
+                self.store.mark_seen(source['id'], [entry['id']])
+            else:
+                self.store.mark_submitted(source['id'], entry['id'], download_id)
+
+        metrics.SUBSCRIPTION_POLLS.inc(platform=platform, result='new' if submitted else 'unchanged')
+        if submitted:
+            metrics.SUBSCRIPTION_ITEMS.inc(len(submitted), platform=platform)
+            logger.info(f"Enqueued {len(submitted)} new item(s) from {source['url']}")
+        # Poll again soon if the cap left items behind, unconditionally: the
+        # listing's validators would get a 304 and strand the rest
+        truncated = len(new) > MAX_NEW_PER_POLL
+        interval = min(source['interval'], 60) if truncated else source['interval']
+        self.store.reschedule(source['id'], self._next_poll(interval), last_polled=now, last_error=None,
+                              etag=None if truncated else listing.etag,
+                              last_modified=None if truncated else listing.last_modified)
+        return len(submitted)
+
+    def settle(self):
+        """Mark finished downloads seen for good and failed ones unseen again"""
+        if self.job_state is None:
+            return
+        for item in self.store.submitted():
+            state = self.job_state(item['download_id'])
+            status = state.get('status') if state else None
+            if status == 'completed':
+                self.store.mark_seen(item['source_id'], [item['media_id']])
+            elif status is None or status in ('error', 'cancelled'):
+                if item['attempts'] >= MAX_ATTEMPTS:
+                    logger.warning(f"Giving up on {item['media_id']} after {item['attempts']} attempts")
+                    self.store.mark_seen(item['source_id'], [item['media_id']])
+                else:
+                    self.store.mark_failed(item['source_id'], item['media_id'])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The shared store at SUBSCRIPTIONS_DB, opened on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SubscriptionStore(DB_PATH)
+        return _store
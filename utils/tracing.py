@@ -0,0 +1,311 @@
+"""
+Per-job tracing
+Records a span for every stage of a download job (queueing, extraction,
+transfer, post-processing, file serving), keeps the spans of recent jobs in
+memory for /api/jobs/<id>/trace and exports them to a JSONL file or an
+OTLP/HTTP-compatible collector. Workers of a work queue push the trace view
+of their jobs to the queue, where the web nodes read it.
+
+Configuration (environment):
+    TRACE_EXPORTER    none (default), jsonl or otlp
+    TRACE_FILE        JSONL output path (default: traces/spans.jsonl)
+    TRACE_OTLP_URL    collector base URL (default: http://localhost:4318)
+    TRACE_MAX_JOBS    jobs kept in memory for the trace view (default: 1000)
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'social-media-downloader'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'job_id', 'name',
+                 'start_ns', 'end_ns', 'attributes', 'status')
+
+    def __init__(self, name, job_id, trace_id, parent_id=None, attributes=None, start_ns=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.job_id = job_id
+        self.name = name
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+
+    @property
+    def duration_ms(self):
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'job_id': self.job_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class JsonlExporter:
+    """Append finished spans to a JSON-lines file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict()) + '\n' for span in spans)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+
+class OtlpHttpExporter:
+    """Batch spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, base_url, batch_size=100, flush_interval=2.0):
+        self.url = base_url.rstrip('/') + '/v1/traces'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def export(self, spans):
+        for span in spans:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                logger.warning("Trace export queue full, dropping span")
+
+    def _run(self):
+        import requests
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                requests.post(self.url, json=self._encode(batch), timeout=5)
+            except Exception as e:
+                logger.warning(f"Trace export to {self.url} failed: {str(e)}")
+
+    @staticmethod
+    def _encode(spans):
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {'key': key, 'value': {'boolValue': value}}
+            if isinstance(value, int):
+                return {'key': key, 'value': {'intValue': str(value)}}
+            if isinstance(value, float):
+                return {'key': key, 'value': {'doubleValue': value}}
+            return {'key': key, 'value': {'stringValue': str(value)}}
+
+        return {'resourceSpans': [{
+            'resource': {'attributes': [attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns),
+                    'attributes': [attribute('job.id', span.job_id)] +
+                                  [attribute(k, v) for k, v in span.attributes.items()],
+                    'status': {'code': 2 if span.status == 'error' else 1},
+                } for span in spans],
+            }],
+        }]}
+
+
+class Tracer:
+    def __init__(self, exporters=(), max_jobs=1000):
+        self.exporters = list(exporters)
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _trace_id(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = {'trace_id': uuid.uuid4().hex, 'spans': []}
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+            return job['trace_id']
+
+    def _finish(self, span):
+        span.end_ns = span.end_ns or time.time_ns()
+        with self._lock:
+            job = self._jobs.get(span.job_id)
+            if job is not None:
+                job['spans'].append(span)
+        for exporter in self.exporters:
+            try:
+                exporter.export([span])
+            except Exception as e:
+                logger.warning(f"Span export failed: {str(e)}")
+
+    @contextmanager
+    def span(self, name, job_id=None, **attributes):
+        """Open a child of the current span (or a root span for job_id)
+
+        Without a job to attach to, the block runs untraced.
+        """
+        parent = _current_span.get()
+        if job_id is None and parent is None:
+            yield None
+            return
+        job_id = job_id or parent.job_id
+        parent_id = parent.span_id if parent is not None and parent.job_id == job_id else None
+        span = Span(name, job_id, self._trace_id(job_id), parent_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.attributes['error.type'] = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def record(self, name, start_ns, end_ns, job_id=None, **attributes):
+        """Record a span that was timed elsewhere, e.g. time spent queued"""
+        parent = _current_span.get()
+        if job_id is None and parent is None:
+            return
+        job_id = job_id or parent.job_id
+        parent_id = parent.span_id if parent is not None and parent.job_id == job_id else None
+        span = Span(name, job_id, self._trace_id(job_id), parent_id, attributes, start_ns)
+        span.end_ns = end_ns
+        self._finish(span)
+
+    def get_trace(self, job_id):
+        """Spans of a job as a timeline, plus total time per stage"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            spans = [span.to_dict() for span in job['spans']]
+            trace_id = job['trace_id']
+        return timeline(job_id, trace_id, spans)
+
+
+def timeline(job_id, trace_id, spans):
+    """Trace view of span dicts: ordered, with offsets and per-stage totals"""
+    spans = sorted(spans, key=lambda s: s['start_ns'])
+    if not spans:
+        return {'job_id': job_id, 'trace_id': trace_id, 'duration_ms': 0, 'stages': {}, 'spans': []}
+
+    origin = spans[0]['start_ns']
+    end = max(s['end_ns'] for s in spans)
+    stages = {}
+    entries = []
+    for span in spans:
+        stages[span['name']] = round(stages.get(span['name'], 0) + span['duration_ms'], 3)
+        entries.append(dict(span, offset_ms=round((span['start_ns'] - origin) / 1e6, 3)))
+    return {
+        'job_id': job_id,
+        'trace_id': trace_id,
+        'duration_ms': round((end - origin) / 1e6, 3),
+        'stages': stages,
+        'spans': entries,
+    }
+
+
+def merge(trace, other):
+    """One trace view of a job whose spans were recorded by two processes"""
+    if other is None:
+        return trace
+    return timeline(trace['job_id'], trace['trace_id'], trace['spans'] + other['spans'])
+
+
+class JobContextFilter(logging.Filter):
+    """Add the current job id to log records as %(job_id)s"""
+
+    def filter(self, record):
+        span = _current_span.get()
+        record.job_id = span.job_id if span is not None else '-'
+        return True
+
+
+def current_job_id():
+    span = _current_span.get()
+    return span.job_id if span is not None else None
+
+
+def _build_exporters():
+    kind = os.environ.get('TRACE_EXPORTER', 'none').lower()
+    if kind == 'jsonl':
+        return [JsonlExporter(os.environ.get('TRACE_FILE', os.path.join('traces', 'spans.jsonl')))]
+    if kind == 'otlp':
+        return [OtlpHttpExporter(os.environ.get('TRACE_OTLP_URL', 'http://localhost:4318'))]
+    return []
+
+
+tracer = Tracer(_build_exporters(), int(os.environ.get('TRACE_MAX_JOBS', 1000)))
+span = tracer.span
+record = tracer.record
+get_trace = tracer.get_trace
+
+
+if __name__ == '__main__':
+    # Minimal OTLP/HTTP collector stand-in: writes received spans as JSONL
+    import argparse
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    parser = argparse.ArgumentParser(description='OTLP/HTTP JSON collector stand-in')
+    parser.add_argument('--port', type=int, default=4318)
+    parser.add_argument('--output', default=os.path.join('traces', 'collector.jsonl'))
+    args = parser.parse_args()
+    sink = JsonlExporter(args.output)
+
+    class CollectorHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                payload = json.loads(body)
+                with sink._lock, open(sink.path, 'a') as f:
+                    for resource in payload.get('resourceSpans', []):
+                        for scope in resource.get('scopeSpans', []):
+                            for item in scope.get('spans', []):
+                                f.write(json.dumps(item) + '\n')
+                self.send_response(200)
+            except ValueError:
+                self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    print(f'Collecting OTLP/HTTP spans on :{args.port} into {args.output}')
+    HTTPServer(('0.0.0.0', args.port), CollectorHandler).serve_forever()
@@ -0,0 +1,526 @@
+"""
+Durable work queue between web nodes and download workers
+Web nodes enqueue jobs and read their progress snapshots; workers (worker.py)
+claim jobs, push progress back and pick up cancel requests. A claimed job
+holds a lease that its worker keeps renewing, so jobs of a worker that died
+go back to the queue.
+
+Backends, chosen with WORK_QUEUE:
+    sqlite:///path/to/queue.db   SQLite file shared by every process on a host
+    redis://host:6379/0          Redis (needs the redis package) for multi-host
+    memory://                    In-process stand-in for tests and benchmarks
+
+Unset, the app keeps running downloads in its own threads.
+
+Claims are fair per client: the next job is the oldest of the client with the
+fewest running jobs per unit of CLIENT_WEIGHTS, skipping clients that already
+run CLIENT_MAX_CONCURRENT jobs on any worker.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from utils import scheduler
+
+# Seconds a claimed job stays owned by its worker without a heartbeat
+DEFAULT_LEASE = 60
+
+
+class MemoryQueue:
+    """Work queue kept in process memory"""
+
+    def __init__(self, client_limit=None, weights=None):
+        self.client_limit = scheduler.CLIENT_MAX_CONCURRENT if client_limit is None else client_limit
+        self.weights = scheduler.CLIENT_WEIGHTS if weights is None else weights
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def enqueue(self, job_id, payload, snapshot):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'payload': payload, 'snapshot': snapshot, 'state': 'queued', 'worker': None,
+                'client': payload.get('client') or '', 'lease_until': None, 'cancel': False,
+                'last_seen': now, 'created': now, 'updated': now,
+            }
+
+    def claim(self, worker_id, lease=DEFAULT_LEASE):
+        with self._lock:
+            oldest, queued, running = {}, {}, {}
+            for job_id, job in self._jobs.items():
+                client = job['client']
+                if job['state'] == 'running':
+                    running[client] = running.get(client, 0) + 1
+                elif job['state'] == 'queued' and (client not in queued or job['created'] < queued[client]):
+                    queued[client], oldest[client] = job['created'], job_id
+            client = scheduler.least_served(queued, running, self.client_limit, self.weights)
+            if client is None:
+                return None
+            job = self._jobs[oldest[client]]
+            job.update(state='running', worker=worker_id, lease_until=time.time() + lease)
+            return oldest[client], job['payload']
+
+    def heartbeat(self, job_id, lease=DEFAULT_LEASE):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job['state'] == 'running':
+                job['lease_until'] = time.time() + lease
+
+    def update(self, job_id, snapshot, trace=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(snapshot=snapshot, updated=time.time())
+                if trace is not None:
+                    job['trace'] = trace
+
+    def finish(self, job_id, snapshot, trace=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(snapshot=snapshot, state='done', lease_until=None, updated=time.time())
+                if trace is not None:
+                    job['trace'] = trace
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job['snapshot']) if job else None
+
+    def get_trace(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.get('trace') if job else None
+
+    def touch(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job['last_seen'] = time.time()
+
+    def last_seen(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job['last_seen'] if job else None
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['state'] == 'done':
+                return False
+            if job['state'] == 'queued':
+                job['snapshot'] = dict(job['snapshot'], status='cancelled', error='Download cancelled')
+                job['state'] = 'done'
+            else:
+                job['cancel'] = True
+                job['snapshot'] = dict(job['snapshot'], status='cancelling')
+            return True
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return bool(job and job['cancel'])
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def requeue_expired(self):
+        now = time.time()
+        count = 0
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if job['state'] == 'running' and job['lease_until'] < now:
+                    job.update(state='queued', worker=None, lease_until=None)
+                    count += 1
+        return count
+
+    def purge(self, older_than):
+        cutoff = time.time() - older_than
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items()
+                           if job['state'] == 'done' and job['updated'] < cutoff]:
+                del self._jobs[job_id]
+
+    def depth(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['state'] == 'queued')
+
+
+class SQLiteQueue:
+    """Work queue in a SQLite database (WAL mode, one connection per thread)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            snapshot TEXT NOT NULL,
+            state TEXT NOT NULL,
+            client TEXT NOT NULL DEFAULT '',
+            worker TEXT,
+            lease_until REAL,
+            cancel INTEGER NOT NULL DEFAULT 0,
+            trace TEXT,
+            last_seen REAL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+    """
+
+    # Columns added to jobs since it was first created
+    COLUMNS = {
+        'client': "TEXT NOT NULL DEFAULT ''",
+        'trace': 'TEXT',
+    }
+
+    def __init__(self, path, client_limit=None, weights=None):
+        self.path = path
+        self.client_limit = scheduler.CLIENT_MAX_CONCURRENT if client_limit is None else client_limit
+        self.weights = scheduler.CLIENT_WEIGHTS if weights is None else weights
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(self.SCHEMA)
+        existing = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        for name, definition in self.COLUMNS.items():
+            if name not in existing:
+                try:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+                except sqlite3.OperationalError:
+                    # Added by another process in the meantime
+                    pass
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (state, client, created)")
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def enqueue(self, job_id, payload, snapshot):
+        now = time.time()
+        self._db().execute(
+            "INSERT INTO jobs (id, payload, snapshot, state, client, last_seen, created, updated) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, json.dumps(payload), json.dumps(snapshot), payload.get('client') or '', now, now, now))
+
+    def claim(self, worker_id, lease=DEFAULT_LEASE):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            queued = dict(db.execute(
+                "SELECT client, MIN(created) FROM jobs WHERE state = 'queued' GROUP BY client").fetchall())
+            running = dict(db.execute(
+                "SELECT client, COUNT(*) FROM jobs WHERE state = 'running' GROUP BY client").fetchall())
+            client = scheduler.least_served(queued, running, self.client_limit, self.weights)
+            row = None
+            if client is not None:
+                row = db.execute("SELECT id, payload FROM jobs WHERE state = 'queued' AND client = ? "
+                                 "ORDER BY created LIMIT 1", (client,)).fetchone()
+            if row:
+                db.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ? WHERE id = ?",
+                           (worker_id, time.time() + lease, row[0]))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return (row[0], json.loads(row[1])) if row else None
+
+    def heartbeat(self, job_id, lease=DEFAULT_LEASE):
+        self._db().execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND state = 'running'",
+                           (time.time() + lease, job_id))
+
+    def update(self, job_id, snapshot, trace=None):
+        self._db().execute("UPDATE jobs SET snapshot = ?, trace = COALESCE(?, trace), updated = ? WHERE id = ?",
+                           (json.dumps(snapshot), trace and json.dumps(trace), time.time(), job_id))
+
+    def finish(self, job_id, snapshot, trace=None):
+        self._db().execute(
+            "UPDATE jobs SET snapshot = ?, trace = COALESCE(?, trace), state = 'done', lease_until = NULL, "
+            "updated = ? WHERE id = ?",
+            (json.dumps(snapshot), trace and json.dumps(trace), time.time(), job_id))
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT snapshot FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_trace(self, job_id):
+        row = self._db().execute("SELECT trace FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def touch(self, job_id):
+        self._db().execute("UPDATE jobs SET last_seen = ? WHERE id = ?", (time.time(), job_id))
+
+    def last_seen(self, job_id):
+        row = self._db().execute("SELECT last_seen FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def request_cancel(self, job_id):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute("SELECT state, snapshot FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row or row[0] == 'done':
+                db.execute('COMMIT')
+                return False
+            snapshot = json.loads(row[1])
+            if row[0] == 'queued':
+                snapshot.update(status='cancelled', error='Download cancelled')
+                db.execute("UPDATE jobs SET state = 'done', snapshot = ?, updated = ? WHERE id = ?",
+                           (json.dumps(snapshot), time.time(), job_id))
+            else:
+                snapshot['status'] = 'cancelling'
+                db.execute("UPDATE jobs SET cancel = 1, snapshot = ? WHERE id = ?",
+                           (json.dumps(snapshot), job_id))
+            db.execute('COMMIT')
+            return True
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def cancel_requested(self, job_id):
+        row = self._db().execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def delete(self, job_id):
+        self._db().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def requeue_expired(self):
+        cursor = self._db().execute(
+            "UPDATE jobs SET state = 'queued', worker = NULL, lease_until = NULL "
+            "WHERE state = 'running' AND lease_until < ?", (time.time(),))
+        return cursor.rowcount
+
+    def purge(self, older_than):
+        self._db().execute("DELETE FROM jobs WHERE state = 'done' AND updated < ?",
+                           (time.time() - older_than,))
+
+    def depth(self):
+        return self._db().execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+
+# Picks the least served client as scheduler.least_served does, pops its oldest
+# queued job and marks it running with its lease in one step, so a worker dying
+# mid-claim cannot lose a job that is in neither list.
+# KEYS: clients with queued jobs, running jobs by lease expiry
+# ARGV: worker id, lease expiry, job key prefix, pending list prefix,
+#       per-client limit (0 = none), then client/weight pairs
+CLAIM_SCRIPT = """
+local limit = tonumber(ARGV[5])
+local weights = {}
+for i = 6, #ARGV, 2 do
+    weights[ARGV[i]] = tonumber(ARGV[i + 1])
+end
+local running = {}
+for _, job_id in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    local client = redis.call('HGET', ARGV[3] .. job_id, 'client') or ''
+    running[client] = (running[client] or 0) + 1
+end
+local best, best_score, best_created
+for _, client in ipairs(redis.call('SORT', KEYS[1], 'ALPHA')) do
+    local pending = ARGV[4] .. client
+    local head = redis.call('LINDEX', pending, 0)
+    -- Jobs cancelled while queued are still listed
+    while head and redis.call('HGET', ARGV[3] .. head, 'state') ~= 'queued' do
+        redis.call('LPOP', pending)
+        head = redis.call('LINDEX', pending, 0)
+    end
+    local count = running[client] or 0
+    if not head then
+        redis.call('SREM', KEYS[1], client)
+    elseif limit == 0 or count < limit then
+        local score = count / (weights[client] or 1)
+        local created = tonumber(redis.call('HGET', ARGV[3] .. head, 'created')) or 0
+        if not best or score < best_score or (score == best_score and created < best_created) then
+            best, best_score, best_created = client, score, created
+        end
+    end
+end
+if not best then
+    return nil
+end
+local job_id = redis.call('LPOP', ARGV[4] .. best)
+if redis.call('LLEN', ARGV[4] .. best) == 0 then
+    redis.call('SREM', KEYS[1], best)
+end
+local key = ARGV[3] .. job_id
+redis.call('HSET', key, 'state', 'running', 'worker', ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[2], job_id)
+return {job_id, redis.call('HGET', key, 'payload')}
+"""
+
+# Cancels a queued job outright or flags a running one, reading the state and
+# writing it in one step so a claim cannot land in between
+# KEYS: the job's hash; ARGV: current time
+CANCEL_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'done' then
+    return 0
+end
+local snapshot = cjson.decode(redis.call('HGET', KEYS[1], 'snapshot'))
+if state == 'queued' then
+    snapshot['status'] = 'cancelled'
+    snapshot['error'] = 'Download cancelled'
+    redis.call('HSET', KEYS[1], 'state', 'done', 'snapshot', cjson.encode(snapshot), 'updated', ARGV[1])
+else
+    snapshot['status'] = 'cancelling'
+    redis.call('HSET', KEYS[1], 'cancel', 1, 'snapshot', cjson.encode(snapshot))
+end
+return 1
+"""
+
+
+class RedisQueue:
+    """Work queue in Redis: a pending list per client plus one hash per job"""
+
+    def __init__(self, url, prefix='smd', client_limit=None, weights=None):
+        try:
+            import redis
+        except ImportError:
+            raise Exception("WORK_QUEUE is a redis:// URL but the redis package is not installed")
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.client_limit = scheduler.CLIENT_MAX_CONCURRENT if client_limit is None else client_limit
+        self.weights = scheduler.CLIENT_WEIGHTS if weights is None else weights
+        # Clients with queued jobs, and each one's pending list under this prefix
+        self.clients = f'{prefix}:clients'
+        self.pending = f'{prefix}:pending:'
+        self.running = f'{prefix}:running'
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+        self._cancel = self.redis.register_script(CANCEL_SCRIPT)
+
+    def _key(self, job_id):
+        return f'{self.prefix}:job:{job_id}'
+
+    def enqueue(self, job_id, payload, snapshot):
+        now = time.time()
+        client = payload.get('client') or ''
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job_id), mapping={
+            'payload': json.dumps(payload), 'snapshot': json.dumps(snapshot), 'state': 'queued',
+            'client': client, 'cancel': 0, 'last_seen': now, 'created': now, 'updated': now,
+        })
+        pipe.rpush(self.pending + client, job_id)
+        pipe.sadd(self.clients, client)
+        pipe.execute()
+
+    def claim(self, worker_id, lease=DEFAULT_LEASE):
+        weights = [value for pair in self.weights.items() for value in pair]
+        claimed = self._claim(keys=[self.clients, self.running],
+                              args=[worker_id, time.time() + lease, self._key(''), self.pending,
+                                    self.client_limit or 0, *weights])
+        if claimed is None:
+            return None
+        job_id, payload = claimed
+        return job_id, json.loads(payload)
+
+    def heartbeat(self, job_id, lease=DEFAULT_LEASE):
+        self.redis.zadd(self.running, {job_id: time.time() + lease}, xx=True)
+
+    def update(self, job_id, snapshot, trace=None):
+        fields = {'snapshot': json.dumps(snapshot), 'updated': time.time()}
+        if trace is not None:
+            fields['trace'] = json.dumps(trace)
+        self.redis.hset(self._key(job_id), mapping=fields)
+
+    def finish(self, job_id, snapshot, trace=None):
+        fields = {'snapshot': json.dumps(snapshot), 'state': 'done', 'updated': time.time()}
+        if trace is not None:
+            fields['trace'] = json.dumps(trace)
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job_id), mapping=fields)
+        pipe.zrem(self.running, job_id)
+        pipe.execute()
+
+    def get(self, job_id):
+        snapshot = self.redis.hget(self._key(job_id), 'snapshot')
+        return json.loads(snapshot) if snapshot else None
+
+    def get_trace(self, job_id):
+        trace = self.redis.hget(self._key(job_id), 'trace')
+        return json.loads(trace) if trace else None
+
+    def touch(self, job_id):
+        if self.redis.exists(self._key(job_id)):
+            self.redis.hset(self._key(job_id), 'last_seen', time.time())
+
+    def last_seen(self, job_id):
+        value = self.redis.hget(self._key(job_id), 'last_seen')
+        return float(value) if value else None
+
+    def request_cancel(self, job_id):
+        return bool(self._cancel(keys=[self._key(job_id)], args=[time.time()]))
+
+    def cancel_requested(self, job_id):
+        return self.redis.hget(self._key(job_id), 'cancel') == '1'
+
+    def delete(self, job_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key(job_id))
+        pipe.zrem(self.running, job_id)
+        pipe.execute()
+
+    def requeue_expired(self):
+        count = 0
+        for job_id in self.redis.zrangebyscore(self.running, 0, time.time()):
+            # Only the caller that removes the entry requeues it
+            if self.redis.zrem(self.running, job_id):
+                client = self.redis.hget(self._key(job_id), 'client') or ''
+                pipe = self.redis.pipeline()
+                pipe.hset(self._key(job_id), 'state', 'queued')
+                pipe.rpush(self.pending + client, job_id)
+                pipe.sadd(self.clients, client)
+                pipe.execute()
+                count += 1
+        return count
+
+    def purge(self, older_than):
+        cutoff = time.time() - older_than
+        for key in self.redis.scan_iter(f'{self.prefix}:job:*'):
+            state, updated = self.redis.hmget(key, 'state', 'updated')
+            if state == 'done' and updated and float(updated) < cutoff:
+                self.redis.delete(key)
+
+    def depth(self):
+        pipe = self.redis.pipeline()
+        for client in self.redis.smembers(self.clients):
+            pipe.llen(self.pending + client)
+        return sum(pipe.execute())
+
+
+def enqueue_download(queue, url, format_type='best', clip=None, client=None):
+    """Queue a download job for the workers; returns its download id"""
+    download_id = str(uuid.uuid4())
+    payload = {'url': url, 'format': format_type, 'clip': clip, 'client': client, 'queued_ns': time.time_ns()}
+    snapshot = {'status': 'starting', 'progress': 0, 'url': url, 'format': format_type, 'clip': clip}
+    queue.enqueue(download_id, payload, snapshot)
+    return download_id
+
+
+def create_queue(url):
+    """Build a queue from a WORK_QUEUE URL"""
+    parts = urlparse(url)
+    if parts.scheme == 'sqlite':
+        return SQLiteQueue(url[len('sqlite:///'):] if url.startswith('sqlite:///') else parts.path)
+    if parts.scheme in ('redis', 'rediss'):
+        return RedisQueue(url)
+    if parts.scheme == 'memory':
+        return MemoryQueue()
+    raise ValueError(f"Unsupported WORK_QUEUE: {url}")
+
+
+def from_env():
+    """The queue configured in WORK_QUEUE, or None to run jobs in process"""
+    url = os.environ.get('WORK_QUEUE')
+    return create_queue(url) if url else None
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Download worker - pulls jobs from the work queue and runs them
+
+Web nodes started with WORK_QUEUE set only enqueue jobs and serve progress and
+files; one or more workers (on the same host or others sharing the queue and
+the downloads directory) do the actual downloading.
+
+    WORK_QUEUE=sqlite:///data/queue.db python worker.py --concurrency 4
+"""
+
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+import app
+from utils import jobs, metrics, subscriptions, tracing
+from utils import work_queue as work_queues
+from utils.jobs import download_progress
+
+logger = logging.getLogger('worker')
+
+# How often progress is pushed to the queue and cancel flags are read
+SYNC_INTERVAL = 0.5
+
+# How long finished jobs stay in the queue for progress/file lookups
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION', 24 * 3600))
+
+
+class Worker:
+    def __init__(self, queue, concurrency=None, worker_id=None, poll_interval=1.0,
+                 lease=work_queues.DEFAULT_LEASE):
+        self.queue = queue
+        self.concurrency = concurrency or int(os.environ.get('CONCURRENT_DOWNLOADS', 5))
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the download slots and the sync loop in background threads"""
+        for i in range(self.concurrency):
+            self._threads.append(threading.Thread(target=self._slot, name=f'download-{i}', daemon=True))
+        self._threads.append(threading.Thread(target=self._sync, name='queue-sync', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Worker {self.worker_id} started with {self.concurrency} download slots")
+        return self
+
+    def stop(self, timeout=None):
+        """Stop claiming jobs and wait for running ones to finish"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self):
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            logger.info("Stopping, waiting for running downloads to finish")
+            self.stop()
+
+    def _slot(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.queue.claim(self.worker_id, self.lease)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {str(e)}")
+                claimed = None
+            if claimed is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._process(*claimed)
+
+    def _process(self, download_id, payload):
+        url, format_type = payload['url'], payload.get('format', 'best')
+        download_progress[download_id] = {
+            'status': 'starting',
+            'progress': 0,
+            'url': url,
+            'format': format_type,
+            'clip': payload.get('clip'),
+            # Usage is billed to this client once the job completes
+            'client': payload.get('client')
+        }
+        # Idle cancellation uses the poll times the web nodes record in the queue
+        jobs.register(download_id, reap=False)
+        with self._lock:
+            self._running.add(download_id)
+        try:
+            app.run_download(download_id, url, format_type, payload.get('queued_ns'), payload.get('clip'))
+        finally:
+            with self._lock:
+                self._running.discard(download_id)
+            self.queue.finish(download_id, download_progress.pop(download_id), tracing.get_trace(download_id))
+
+    def _sync(self):
+        last_requeue = last_purge = 0
+        while not self._stop.wait(SYNC_INTERVAL):
+            now = time.time()
+            with self._lock:
+                running = list(self._running)
+            for download_id in running:
+                try:
+                    self._sync_job(download_id, now)
+                except Exception as e:
+                    logger.warning(f"Syncing job {download_id} failed: {str(e)}")
+            try:
+                if now - last_requeue > self.lease / 2:
+                    requeued = self.queue.requeue_expired()
+                    if requeued:
+                        logger.warning(f"Requeued {requeued} job(s) from workers that stopped responding")
+                    last_requeue = now
+                if now - last_purge > 60:
+                    self.queue.purge(JOB_RETENTION)
+                    last_purge = now
+            except Exception as e:
+                logger.warning(f"Queue maintenance failed: {str(e)}")
+
+    def _sync_job(self, download_id, now):
+        snapshot = download_progress.get(download_id)
+        if snapshot is None:
+            return
+        self.queue.heartbeat(download_id, self.lease)
+        if self.queue.cancel_requested(download_id):
+            jobs.cancel(download_id)
+        elif jobs.IDLE_TIMEOUT > 0 and snapshot.get('client') != subscriptions.CLIENT:
+            last_seen = self.queue.last_seen(download_id)
+            if last_seen and now - last_seen > jobs.IDLE_TIMEOUT:
+                jobs.cancel(download_id, reason=f'not polled for {jobs.IDLE_TIMEOUT:.0f}s')
+        # The web nodes serve /api/jobs/<id>/trace from the queue
+        self.queue.update(download_id, dict(snapshot), tracing.get_trace(download_id))
+
+
+def serve_metrics(port):
+    """Expose this worker's /metrics on its own port"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run downloads from the work queue')
+    parser.add_argument('--queue', default=os.environ.get('WORK_QUEUE', 'sqlite:///data/queue.db'),
+                        help='queue URL (default: $WORK_QUEUE or sqlite:///data/queue.db)')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='parallel downloads (default: $CONCURRENT_DOWNLOADS or 5)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='serve /metrics on this port')
+    parser.add_argument('--watch', action='store_true',
+                        help='also poll subscriptions and enqueue their new items (run on one worker only)')
+    args = parser.parse_args(argv)
+
+    queue = work_queues.create_queue(args.queue)
+    metrics.QUEUE_DEPTH.set_function(queue.depth)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    if args.watch:
+        subscriptions.SubscriptionScheduler(
+            subscriptions.get_store(),
+            lambda url, format_type: work_queues.enqueue_download(queue, url, format_type,
+                                                                 client=subscriptions.CLIENT),
+            job_state=queue.get).start()
+    Worker(queue, args.concurrency).run()
+
+
+if __name__ == '__main__':
+    main()